@@ -0,0 +1,119 @@
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+from app.config import (
+    ADMISSION_WEBHOOK_CONCURRENCY, ADMISSION_WEBHOOK_QUEUE, ADMISSION_MANUAL_CONCURRENCY,
+    ADMISSION_MANUAL_QUEUE, ADMISSION_ENDPOINT_LIMITS, ADMISSION_SHEET_MAX_PENDING,
+    ADMISSION_SHEET_LIMITS, ADMISSION_RETRY_AFTER_SECONDS
+)
+from app import metrics
+
+WEBHOOK_ENDPOINTS = ("/apps-script-sync", "/apps-script-delta", "/apps-script-delta/batch")
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, message: str, status_code: int, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class _EndpointQueue:
+    def __init__(self, concurrency: int, queue_size: int):
+        self.concurrency = max(1, concurrency)
+        self.queue_size = max(0, queue_size)
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        # Requests admitted and not yet finished, running or queued
+        self.pending = 0
+        self.avg_seconds = None
+
+    def observe(self, seconds: float):
+        # Exponentially weighted, so Retry-After follows the recent service time
+        self.avg_seconds = seconds if self.avg_seconds is None else 0.8 * self.avg_seconds + 0.2 * seconds
+
+
+class AdmissionController:
+    """
+    Bounded queues in front of the sync endpoints
+    A request is admitted only while its endpoint has room (concurrency running
+    plus queue waiting) and, for webhooks, while its spreadsheet is under its
+    pending limit. Everything else is rejected at once with a Retry-After
+    estimated from the endpoint's recent service time, instead of piling up
+    until clients time out
+    """
+
+    def __init__(self, endpoint_limits: dict = ADMISSION_ENDPOINT_LIMITS, sheet_limits: dict = ADMISSION_SHEET_LIMITS):
+        self.endpoint_limits = endpoint_limits
+        self.sheet_limits = sheet_limits
+        self._queues = {}
+        self._sheet_pending = {}
+
+    def _queue(self, endpoint: str) -> _EndpointQueue:
+        queue = self._queues.get(endpoint)
+        if queue is None:
+            if endpoint in WEBHOOK_ENDPOINTS:
+                concurrency, queue_size = ADMISSION_WEBHOOK_CONCURRENCY, ADMISSION_WEBHOOK_QUEUE
+            else:
+                concurrency, queue_size = ADMISSION_MANUAL_CONCURRENCY, ADMISSION_MANUAL_QUEUE
+            override = self.endpoint_limits.get(endpoint, {})
+            queue = self._queues[endpoint] = _EndpointQueue(
+                override.get("concurrency", concurrency), override.get("queue", queue_size)
+            )
+        return queue
+
+    def _sheet_limit(self, sheet_id: str) -> int:
+        return self.sheet_limits.get(sheet_id, ADMISSION_SHEET_MAX_PENDING)
+
+    def _retry_after(self, queue: _EndpointQueue, pending: int) -> int:
+        if queue.avg_seconds is None:
+            return ADMISSION_RETRY_AFTER_SECONDS
+        # Time for the work already ahead of a retry to drain
+        return max(ADMISSION_RETRY_AFTER_SECONDS, math.ceil(queue.avg_seconds * pending / queue.concurrency))
+
+    def _reject(self, endpoint: str, reason: str, message: str, status_code: int, retry_after: int):
+        metrics.admission_requests.inc(endpoint=endpoint, outcome=reason)
+        raise AdmissionRejected(message, status_code, retry_after)
+
+    @asynccontextmanager
+    async def admit(self, endpoint: str, sheet_id: str = None):
+        """Hold a place in the endpoint's queue for the request, or raise AdmissionRejected"""
+        queue = self._queue(endpoint)
+        if queue.pending >= queue.concurrency + queue.queue_size:
+            self._reject(endpoint, "endpoint_full", f"{endpoint} is at capacity, retry later",
+                         503, self._retry_after(queue, queue.pending))
+        if sheet_id is not None:
+            sheet_pending = self._sheet_pending.get(sheet_id, 0)
+            if sheet_pending >= self._sheet_limit(sheet_id):
+                self._reject(endpoint, "sheet_full", f"Too many pending syncs for sheet {sheet_id}, retry later",
+                             429, self._retry_after(queue, sheet_pending))
+            self._sheet_pending[sheet_id] = sheet_pending + 1
+
+        metrics.admission_requests.inc(endpoint=endpoint, outcome="admitted")
+        queue.pending += 1
+        try:
+            async with queue.semaphore:
+                started = time.perf_counter()
+                try:
+                    yield
+                finally:
+                    queue.observe(time.perf_counter() - started)
+        finally:
+            queue.pending -= 1
+            if sheet_id is not None:
+                self._sheet_pending[sheet_id] -= 1
+                if not self._sheet_pending[sheet_id]:
+                    del self._sheet_pending[sheet_id]
+
+    def stats(self):
+        return {
+            "endpoints": {
+                endpoint: {"concurrency": queue.concurrency, "queue": queue.queue_size, "pending": queue.pending,
+                           "avg_seconds": None if queue.avg_seconds is None else round(queue.avg_seconds, 3)}
+                for endpoint, queue in self._queues.items()
+            },
+            "sheets_pending": dict(self._sheet_pending),
+        }
+
+
+admission = AdmissionController()
@@ -1,8 +1,10 @@
+from sqlalchemy import inspect, text
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import declarative_base
 from app.config import DATABASE_URL
 
-engine = create_async_engine(DATABASE_URL)
+# local_infile lets MySQLService.bulk_load stream files with LOAD DATA LOCAL INFILE
+engine = create_async_engine(DATABASE_URL, connect_args={"local_infile": True})
 AsyncSessionLocal = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 Base = declarative_base()
 
@@ -13,6 +15,19 @@ async def get_db():
         finally:
             await session.close()
 
+def _add_missing_columns(conn):
+    """create_all never alters existing tables, so add model columns introduced since"""
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=conn.dialect)
+                conn.execute(text(f"ALTER TABLE `{table.name}` ADD COLUMN `{column.name}` {column_type} NULL"))
+
 async def init_db():
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
\ No newline at end of file
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_add_missing_columns)
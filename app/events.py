@@ -0,0 +1,86 @@
+import asyncio
+import itertools
+import time
+from collections import deque
+from app.config import EVENTS_CLIENT_BUFFER, EVENTS_MAX_SUBSCRIBERS
+from app import metrics
+
+
+class TooManySubscribers(Exception):
+    pass
+
+
+class Subscription:
+    """
+    One client's bounded event buffer
+    A client that falls behind loses its oldest events rather than slowing the
+    publisher; the next read reports how many were dropped (a "lagged" event)
+    so the client can re-fetch state instead of trusting a gap
+    """
+
+    def __init__(self, config_id: str = None, buffer_size: int = EVENTS_CLIENT_BUFFER):
+        self.config_id = config_id
+        self._events = deque(maxlen=max(1, buffer_size))
+        self._ready = asyncio.Event()
+        self.dropped = 0
+
+    def wants(self, event: dict) -> bool:
+        return self.config_id is None or event.get("config_id") in (None, self.config_id)
+
+    def push(self, event: dict):
+        if len(self._events) == self._events.maxlen:
+            self.dropped += 1
+            metrics.events_dropped.inc()
+        self._events.append(event)
+        self._ready.set()
+
+    async def get(self, timeout: float):
+        """Next event, or None if nothing arrived within timeout"""
+        if not self._events and not self.dropped:
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            return {"type": "lagged", "dropped": dropped, "time": time.time()}
+        return self._events.popleft()
+
+
+class EventBus:
+    """
+    In-process pub/sub for sync activity (pass start/finish/failure, rows
+    changed, configs created). Publishing never blocks: every subscriber has
+    its own bounded buffer. Only passes run by this process are seen, so with
+    SYNC_MODE=external the polling passes of the workers are not streamed
+    """
+
+    def __init__(self, max_subscribers: int = EVENTS_MAX_SUBSCRIBERS):
+        self.max_subscribers = max_subscribers
+        self._subscribers = set()
+        self._ids = itertools.count(1)
+
+    def subscribe(self, config_id: str = None) -> Subscription:
+        if len(self._subscribers) >= self.max_subscribers:
+            raise TooManySubscribers(f"Event stream is at its limit of {self.max_subscribers} subscribers")
+        subscription = Subscription(config_id)
+        self._subscribers.add(subscription)
+        metrics.event_subscribers.set(len(self._subscribers))
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self._subscribers.discard(subscription)
+        metrics.event_subscribers.set(len(self._subscribers))
+
+    def publish(self, event_type: str, **fields):
+        event = {"id": next(self._ids), "type": event_type, "time": time.time(), **fields}
+        for subscription in self._subscribers:
+            if subscription.wants(event):
+                subscription.push(event)
+
+    def stats(self):
+        return {"subscribers": len(self._subscribers), "max_subscribers": self.max_subscribers}
+
+
+event_bus = EventBus()
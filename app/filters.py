@@ -0,0 +1,81 @@
+OPERATORS = ("eq", "ne", "in", "not_in", "contains")
+
+
+def _text(value) -> str:
+    # Synced tables use a case-insensitive collation, so compare the same way here
+    return "" if value is None else str(value).strip().casefold()
+
+
+def _get_ignoring_case(row: dict, column: str):
+    # Column names are case-insensitive in MySQL, so the filter may spell them differently
+    column = column.lower()
+    return next((value for key, value in row.items() if key.lower() == column), None)
+
+
+class RowFilter:
+    """
+    Per-config row predicate, e.g. [{"column": "status", "op": "eq", "value": "open"}]
+    Conditions are ANDed and name table columns. Sheet→DB evaluates it on each
+    transformed row; DB→Sheet pushes it down as a SQL WHERE clause
+    """
+
+    def __init__(self, conditions=None):
+        self.conditions = []
+        for condition in conditions or []:
+            column = condition.get("column") if isinstance(condition, dict) else None
+            op = condition.get("op", "eq") if isinstance(condition, dict) else None
+            if not column or op not in OPERATORS:
+                raise ValueError(f"Invalid row filter condition {condition}; ops are {', '.join(OPERATORS)}")
+            value = condition.get("value")
+            if op in ("in", "not_in"):
+                if not isinstance(value, list):
+                    raise ValueError(f"Row filter op '{op}' needs a list value")
+                value = [_text(item) for item in value]
+            else:
+                value = _text(value)
+            self.conditions.append((column, op, value))
+
+    def __bool__(self):
+        return bool(self.conditions)
+
+    def matches(self, row: dict) -> bool:
+        for column, op, value in self.conditions:
+            cell = _text(row[column] if column in row else _get_ignoring_case(row, column))
+            if op == "eq" and cell != value:
+                return False
+            if op == "ne" and cell == value:
+                return False
+            if op == "in" and cell not in value:
+                return False
+            if op == "not_in" and cell in value:
+                return False
+            if op == "contains" and value not in cell:
+                return False
+        return True
+
+    def where_clause(self):
+        """(SQL condition, bind params) equivalent to matches(), or (None, {}) without conditions"""
+        clauses, params = [], {}
+        for i, (column, op, value) in enumerate(self.conditions):
+            quoted = "`" + column.replace("`", "``") + "`"
+            # NULL is stored for cells that were never written; treat it as empty like matches() does
+            cell = f"COALESCE(TRIM({quoted}), '')"
+            name = f"filter_{i}"
+            if op in ("eq", "ne"):
+                params[name] = value
+                clauses.append(f"{cell} {'=' if op == 'eq' else '<>'} :{name}")
+            elif op in ("in", "not_in"):
+                if not value:
+                    clauses.append("1 = 0" if op == "in" else "1 = 1")
+                    continue
+                names = [f"{name}_{j}" for j in range(len(value))]
+                params.update(zip(names, value))
+                placeholders = ", ".join(f":{n}" for n in names)
+                clauses.append(f"{cell} {'IN' if op == 'in' else 'NOT IN'} ({placeholders})")
+            else:
+                escaped = value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+                params[name] = f"%{escaped}%"
+                clauses.append(f"{cell} LIKE :{name}")
+        if not clauses:
+            return None, {}
+        return " AND ".join(clauses), params
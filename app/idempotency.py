@@ -0,0 +1,60 @@
+import time
+from collections import OrderedDict
+from app.config import IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_TTL_SECONDS
+
+IN_PROGRESS = object()
+
+
+class IdempotencyCache:
+    """
+    Bounded, TTL-limited record of webhook deliveries by idempotency key
+    The first delivery claims its key; repeats within the TTL get the stored
+    response (or learn the first one is still running) instead of being
+    processed. With one TTL for every key, insertion order is expiry order,
+    so the oldest entries are both the first to expire and the first evicted
+    """
+
+    def __init__(self, max_entries: int = IDEMPOTENCY_CACHE_SIZE, ttl: float = IDEMPOTENCY_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self.duplicates = 0
+
+    def _expire(self, now: float):
+        while self._entries:
+            key, (expires, _) = next(iter(self._entries.items()))
+            if expires > now:
+                break
+            del self._entries[key]
+
+    def claim(self, key: str):
+        """
+        Returns None if the key is new (and now claimed), otherwise the stored
+        response, or IN_PROGRESS while the first delivery is still being handled
+        """
+        now = time.monotonic()
+        self._expire(now)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.duplicates += 1
+            return entry[1]
+        self._entries[key] = (now + self.ttl, IN_PROGRESS)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return None
+
+    def complete(self, key: str, response):
+        if key in self._entries:
+            # Entries stay in insertion order, so the oldest expires first
+            self._entries[key] = (self._entries[key][0], response)
+
+    def release(self, key: str):
+        """Forget a claim whose handling failed, so a retry is processed again"""
+        self._entries.pop(key, None)
+
+    def stats(self):
+        return {"entries": len(self._entries), "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl, "duplicates": self.duplicates}
+
+
+webhook_dedupe = IdempotencyCache()
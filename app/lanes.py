@@ -0,0 +1,89 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from app.config import (
+    SYNC_MAX_CONCURRENT_PASSES, SYNC_LANE_RESERVED_INTERACTIVE, SYNC_LANE_RESERVED_MANUAL,
+    SYNC_LANE_RESERVED_BACKGROUND
+)
+from app import metrics
+
+# Highest priority first
+LANES = ("interactive", "manual", "background")
+
+
+class LaneScheduler:
+    """
+    Priority lanes for sync passes within one process
+    Each lane keeps its reserved slots; the remaining slots are shared, and a
+    lane only takes a shared slot while no higher-priority lane is waiting for
+    one. Background polls therefore never delay an edit beyond their own
+    reservation: they wait until interactive and manual work has been placed
+    """
+
+    def __init__(self, total: int = SYNC_MAX_CONCURRENT_PASSES, reserved: dict = None):
+        if reserved is None:
+            reserved = {
+                "interactive": SYNC_LANE_RESERVED_INTERACTIVE,
+                "manual": SYNC_LANE_RESERVED_MANUAL,
+                "background": SYNC_LANE_RESERVED_BACKGROUND,
+            }
+        self.reserved = {lane: max(0, reserved.get(lane, 0)) for lane in LANES}
+        self.total = max(total, sum(self.reserved.values()))
+        self.shared = self.total - sum(self.reserved.values())
+        self.running = dict.fromkeys(LANES, 0)
+        self.waiting = dict.fromkeys(LANES, 0)
+        self.deferred = dict.fromkeys(LANES, 0)
+        self._changed = asyncio.Condition()
+
+    def _shared_in_use(self):
+        return sum(max(0, self.running[lane] - self.reserved[lane]) for lane in LANES)
+
+    def _can_start(self, lane: str) -> bool:
+        if self.running[lane] < self.reserved[lane]:
+            return True
+        if self._shared_in_use() >= self.shared:
+            return False
+        # Shared slots go to the highest-priority lane with someone waiting
+        return not any(self.waiting[higher] for higher in LANES[:LANES.index(lane)])
+
+    @asynccontextmanager
+    async def slot(self, lane: str):
+        """Hold one pass slot in `lane`, waiting behind higher-priority work if needed"""
+        if lane not in LANES:
+            raise ValueError(f"Unknown sync lane '{lane}'; lanes are {', '.join(LANES)}")
+        started = time.perf_counter()
+        async with self._changed:
+            if not self._can_start(lane):
+                self.deferred[lane] += 1
+                self.waiting[lane] += 1
+                try:
+                    await self._changed.wait_for(lambda: self._can_start(lane))
+                finally:
+                    self.waiting[lane] -= 1
+                    # Lower lanes may have been held back only by us
+                    self._changed.notify_all()
+            self.running[lane] += 1
+        metrics.lane_wait.observe(time.perf_counter() - started, lane=lane)
+        metrics.lane_running.set(self.running[lane], lane=lane)
+        try:
+            yield
+        finally:
+            async with self._changed:
+                self.running[lane] -= 1
+                self._changed.notify_all()
+            metrics.lane_running.set(self.running[lane], lane=lane)
+            metrics.lane_latency.observe(time.perf_counter() - started, lane=lane)
+
+    def stats(self):
+        return {
+            "total": self.total,
+            "shared": self.shared,
+            "lanes": {
+                lane: {"reserved": self.reserved[lane], "running": self.running[lane],
+                       "waiting": self.waiting[lane], "deferred": self.deferred[lane]}
+                for lane in LANES
+            },
+        }
+
+
+sync_lanes = LaneScheduler()
@@ -0,0 +1,155 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from sqlalchemy import text
+from app.database import engine
+from app.config import SYNC_LOCK_WAIT_SECONDS
+from app import metrics
+
+
+class LockNotAcquired(Exception):
+    pass
+
+
+class PassLock:
+    """
+    Per-config lock held for the duration of a sync pass, across every
+    instance sharing the database. Uses MySQL GET_LOCK on a dedicated
+    connection, so the lock also goes away if the holder's connection dies
+    """
+
+    @staticmethod
+    def _name(config_id: str):
+        # MySQL lock names are limited to 64 characters
+        return f"superjoin_sync:{config_id}"[:64]
+
+    async def _acquire(self, conn, config_id: str, policy: str, wait: float):
+        """Take one config's lock on conn or raise LockNotAcquired"""
+        name = self._name(config_id)
+        started = time.perf_counter()
+        acquired = (await conn.execute(text("SELECT GET_LOCK(:name, 0)"), {"name": name})).scalar() == 1
+        if acquired:
+            return
+        if policy == "skip":
+            metrics.lock_contention.inc(config=config_id, outcome="skipped")
+            raise LockNotAcquired(f"Sync pass for {config_id} already running elsewhere")
+        acquired = (await conn.execute(
+            text("SELECT GET_LOCK(:name, :wait)"), {"name": name, "wait": max(0, wait)}
+        )).scalar() == 1
+        metrics.lock_wait.observe(time.perf_counter() - started, config=config_id)
+        if not acquired:
+            metrics.lock_contention.inc(config=config_id, outcome="timed_out")
+            raise LockNotAcquired(f"Timed out after {wait}s waiting for sync pass lock on {config_id}")
+        metrics.lock_contention.inc(config=config_id, outcome="waited")
+    
+    @asynccontextmanager
+    async def hold(self, config_id: str, policy: str = "queue", wait: float = SYNC_LOCK_WAIT_SECONDS):
+        """
+        Acquire the config's lock or raise LockNotAcquired
+        policy "skip" gives up immediately when another pass holds the lock;
+        "queue" waits up to `wait` seconds for it
+        """
+        async with self.hold_many([config_id], policy, wait):
+            yield
+    
+    @asynccontextmanager
+    async def hold_many(self, config_ids, policy: str = "queue", wait: float = SYNC_LOCK_WAIT_SECONDS):
+        """
+        Acquire several configs' locks on one connection (MySQL 5.7+ allows
+        many named locks per session), so a multi-tab pass uses one pooled
+        connection however many tabs it has. Locks are taken in sorted order so
+        two passes cannot deadlock; `wait` bounds the whole acquisition. All
+        are released together, including after a partial failure
+        """
+        deadline = time.monotonic() + wait
+        async with engine.connect() as conn:
+            try:
+                for config_id in sorted(set(config_ids)):
+                    await self._acquire(conn, config_id, policy, deadline - time.monotonic())
+                yield
+            finally:
+                await conn.execute(text("SELECT RELEASE_ALL_LOCKS()"))
+
+
+class _FollowUp:
+    def __init__(self, runner, priority: int):
+        self.runner = runner
+        self.priority = priority
+        self.directions = set()
+        self.force = False
+        self.future = asyncio.get_running_loop().create_future()
+
+    def merge(self, directions, force: bool, runner, priority: int):
+        self.directions.update(directions)
+        self.force = self.force or force
+        # Run on behalf of the most urgent requester (lower is more urgent)
+        if priority < self.priority:
+            self.runner, self.priority = runner, priority
+
+
+class PassCoalescer:
+    """
+    In-process guard so only one pass per config runs at a time
+    Requests that arrive while a pass is running are collapsed into a single
+    follow-up pass (covering the union of their directions) that starts as
+    soon as the current one finishes; all of them share its result
+    """
+
+    def __init__(self, direction_order):
+        self.direction_order = tuple(direction_order)
+        self._busy = set()
+        self._follow_ups = {}
+        self.stats = {"started": 0, "deferred": 0, "coalesced": 0, "skipped": 0}
+
+    def _count(self, key: str, outcome: str):
+        self.stats[outcome] += 1
+        metrics.pass_requests.inc(config=key, outcome=outcome)
+
+    def _ordered(self, directions):
+        return tuple(d for d in self.direction_order if d in directions)
+
+    async def run(self, key: str, directions, force: bool, runner, wait: bool = True, priority: int = 0):
+        """
+        Run runner(directions, force) for key, or join the pending follow-up if a
+        pass is already running. With wait=False a busy key returns None instead.
+        A follow-up uses the runner of its lowest-priority-number requester
+        """
+        if key in self._busy:
+            if not wait:
+                self._count(key, "skipped")
+                return None
+            follow_up = self._follow_ups.get(key)
+            if follow_up is None:
+                follow_up = self._follow_ups[key] = _FollowUp(runner, priority)
+                self._count(key, "deferred")
+            else:
+                self._count(key, "coalesced")
+            follow_up.merge(directions, force, runner, priority)
+            return await asyncio.shield(follow_up.future)
+
+        self._busy.add(key)
+        self._count(key, "started")
+        try:
+            return await runner(self._ordered(directions), force)
+        finally:
+            self._start_next(key)
+
+    def _start_next(self, key: str):
+        follow_up = self._follow_ups.pop(key, None)
+        if follow_up is None:
+            self._busy.discard(key)
+            return
+        # Run detached so a caller going away cannot strand the queued requests
+        asyncio.ensure_future(self._run_follow_up(key, follow_up))
+
+    async def _run_follow_up(self, key: str, follow_up: _FollowUp):
+        try:
+            result = await follow_up.runner(self._ordered(follow_up.directions), follow_up.force)
+            follow_up.future.set_result(result)
+        except Exception as e:
+            follow_up.future.set_exception(e)
+        finally:
+            self._start_next(key)
+
+
+pass_lock = PassLock()
@@ -1,24 +1,63 @@
 import sys
 import os
+import json
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from contextlib import asynccontextmanager
 from pydantic import BaseModel
-from typing import Dict
+from typing import Any, Dict, List, Optional
+from datetime import datetime, timezone
 
 from app.database import init_db, get_db
-from app.models import SyncConfig
-from app.sync import sync_service
+from app.models import SyncConfig, SyncWorker, SyncLease
+from app.sync import sync_service, SyncBusy
+from app.config import HEALTH_STALE_SECONDS, SYNC_MODE, EVENTS_KEEPALIVE_SECONDS, ROWS_PAGE_MAX_LIMIT
+from app import metrics
+from app.tracing import tracer
+from app.idempotency import webhook_dedupe, IN_PROGRESS
+from app.lanes import sync_lanes
+from app.admission import admission, AdmissionRejected
+from app.events import event_bus, TooManySubscribers
+from app.filters import RowFilter
+
+class SheetDelta(BaseModel):
+    row: int
+    column: int
+    headers: List[str]
+    values: List[List[Any]]
+
+class DeltaBatch(BaseModel):
+    protocol: int = 1
+    sheet_id: str
+    sheet: str
+    seq: int
+    deltas: List[SheetDelta]
+
+class TabDeltas(BaseModel):
+    sheet: str
+    seq: int
+    deltas: List[SheetDelta]
+
+class DeltaBatchList(BaseModel):
+    protocol: int = 1
+    sheet_id: str
+    batches: List[TabDeltas]
 
 class SyncConfigCreate(BaseModel):
     sheet_id: str
     sheet_name: str
     table_name: str
     column_mapping: Dict[str, str]
+    min_sync_interval: Optional[int] = None
+    max_sync_interval: Optional[int] = None
+    bulk_initial_load: bool = True
+    strict_columns: bool = False
+    row_filter: Optional[List[Dict[str, Any]]] = None
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -43,9 +82,13 @@ async def root():
 async def create_sync(config: SyncConfigCreate, db: AsyncSession = Depends(get_db)):
     try:
         sync_config = await sync_service.create_sync(
-            db, config.sheet_id, config.sheet_name, config.table_name, config.column_mapping
+            db, config.sheet_id, config.sheet_name, config.table_name, config.column_mapping,
+            config.min_sync_interval, config.max_sync_interval, config.bulk_initial_load,
+            config.strict_columns, config.row_filter
         )
         return {"id": sync_config.id, "message": "Sync created successfully"}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -60,14 +103,86 @@ async def list_syncs(db: AsyncSession = Depends(get_db)):
             "sheet_name": config.sheet_name,
             "table_name": config.table_name,
             "is_active": config.is_active,
+            "min_sync_interval": config.min_sync_interval,
+            "max_sync_interval": config.max_sync_interval,
+            "strict_columns": bool(config.strict_columns),
+            "row_filter": config.row_filter,
             "created_at": config.created_at
         }
         for config in configs
     ]
 
+async def _admitted(endpoint: str, sheet_id: Optional[str], handler):
+    """Run a handler once the endpoint's admission queue has room; 429/503 with Retry-After otherwise"""
+    try:
+        async with admission.admit(endpoint, sheet_id):
+            return await handler()
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+@app.get("/sync/{config_id}/rows")
+async def browse_rows(config_id: str, after: Optional[int] = None,
+                      limit: int = Query(100, ge=1, le=ROWS_PAGE_MAX_LIMIT),
+                      order_by: str = "id", columns: Optional[str] = None,
+                      filter_json: Optional[str] = Query(None, alias="filter"),
+                      db: AsyncSession = Depends(get_db)):
+    """
+    One page of a synced table, keyset-paginated on id or sheet_row_id
+    Pass the returned next_cursor as `after` for the next page. columns is a
+    comma-separated projection; filter is a JSON row filter like a config's
+    row_filter. Rows are streamed out as they are read
+    """
+    config = (await db.execute(select(SyncConfig).where(SyncConfig.id == config_id))).scalar_one_or_none()
+    if not config:
+        raise HTTPException(status_code=404, detail=f"Sync config {config_id} not found")
+    if order_by not in ("id", "sheet_row_id"):
+        raise HTTPException(status_code=400, detail="order_by must be id or sheet_row_id")
+    
+    # Column names are matched case-insensitively, as MySQL does
+    table_columns = {column.lower(): column for column in await sync_service.mysql.get_columns(config.table_name)}
+    if columns:
+        selected = [column.strip() for column in columns.split(",") if column.strip()]
+    else:
+        selected = list(table_columns.values())
+    try:
+        row_filter = RowFilter(json.loads(filter_json) if filter_json else None)
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid filter: {e}")
+    unknown = [
+        column for column in selected + [column for column, _, _ in row_filter.conditions]
+        if column.lower() not in table_columns
+    ]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown columns for {config.table_name}: {', '.join(unknown)}")
+    selected = [table_columns[column.lower()] for column in selected]
+    # The cursor column is always read, even when it is not projected
+    read_columns = selected if order_by in selected else selected + [order_by]
+    where, params = row_filter.where_clause()
+    
+    async def page():
+        header = {"config_id": config.id, "table": config.table_name, "order_by": order_by, "columns": selected}
+        yield json.dumps(header)[:-1] + ', "rows": ['
+        count, last_key, has_more = 0, None, False
+        # One row past the page tells whether there is a next page
+        async for row in sync_service.mysql.iter_rows(config.table_name, read_columns, order_by, after,
+                                                      limit + 1, where, params):
+            if count == limit:
+                # Not a break: the generator must run to the end to release its connection
+                has_more = True
+                continue
+            last_key = row[order_by]
+            yield ("," if count else "") + json.dumps({column: row[column] for column in selected}, default=str)
+            count += 1
+        yield f'], "count": {count}, "next_cursor": {json.dumps(last_key if has_more else None)}}}'
+    
+    return StreamingResponse(page(), media_type="application/json")
+
 @app.post("/manual-sync")
 async def manual_sync(db: AsyncSession = Depends(get_db)):
     """Trigger manual sync for all configurations"""
+    return await _admitted("/manual-sync", None, lambda: _manual_sync(db))
+
+async def _manual_sync(db: AsyncSession):
     try:
         result = await db.execute(select(SyncConfig))
         configs = result.scalars().all()
@@ -76,9 +191,8 @@ async def manual_sync(db: AsyncSession = Depends(get_db)):
         for config in configs:
             try:
                 # Trigger both directions of sync
-                await sync_service._sync_sheet_to_db(config)
-                await sync_service._sync_db_to_sheet(config)
-                sync_results.append({"config_id": config.id, "status": "success"})
+                changed = await sync_service.sync_config(config, force=True)
+                sync_results.append({"config_id": config.id, "status": "skipped" if changed is None else "success"})
             except Exception as e:
                 sync_results.append({"config_id": config.id, "status": "error", "error": str(e)})
         
@@ -89,6 +203,9 @@ async def manual_sync(db: AsyncSession = Depends(get_db)):
 @app.post("/sync-sheet-to-db")
 async def sync_sheet_to_db(db: AsyncSession = Depends(get_db)):
     """Sync Google Sheet → Database only"""
+    return await _admitted("/sync-sheet-to-db", None, lambda: _sync_sheet_to_db(db))
+
+async def _sync_sheet_to_db(db: AsyncSession):
     try:
         result = await db.execute(select(SyncConfig))
         configs = result.scalars().all()
@@ -96,8 +213,12 @@ async def sync_sheet_to_db(db: AsyncSession = Depends(get_db)):
         sync_results = []
         for config in configs:
             try:
-                await sync_service._sync_sheet_to_db(config)
-                sync_results.append({"config_id": config.id, "status": "success", "direction": "Sheet → DB"})
+                changed = await sync_service.sync_config(config, directions=("sheet_to_db",), force=True)
+                sync_results.append({
+                    "config_id": config.id,
+                    "status": "skipped" if changed is None else "success",
+                    "direction": "Sheet → DB"
+                })
             except Exception as e:
                 sync_results.append({"config_id": config.id, "status": "error", "error": str(e)})
         
@@ -108,6 +229,9 @@ async def sync_sheet_to_db(db: AsyncSession = Depends(get_db)):
 @app.post("/sync-db-to-sheet")
 async def sync_db_to_sheet(db: AsyncSession = Depends(get_db)):
     """Sync Database → Google Sheet only"""
+    return await _admitted("/sync-db-to-sheet", None, lambda: _sync_db_to_sheet(db))
+
+async def _sync_db_to_sheet(db: AsyncSession):
     try:
         result = await db.execute(select(SyncConfig))
         configs = result.scalars().all()
@@ -115,8 +239,12 @@ async def sync_db_to_sheet(db: AsyncSession = Depends(get_db)):
         sync_results = []
         for config in configs:
             try:
-                await sync_service._sync_db_to_sheet(config)
-                sync_results.append({"config_id": config.id, "status": "success", "direction": "DB → Sheet"})
+                changed = await sync_service.sync_config(config, directions=("db_to_sheet",))
+                sync_results.append({
+                    "config_id": config.id,
+                    "status": "skipped" if changed is None else "success",
+                    "direction": "DB → Sheet"
+                })
             except Exception as e:
                 sync_results.append({"config_id": config.id, "status": "error", "error": str(e)})
         
@@ -124,20 +252,54 @@ async def sync_db_to_sheet(db: AsyncSession = Depends(get_db)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _find_config(db: AsyncSession, sheet_id: str, sheet_name: Optional[str] = None):
+    """Sync config for a spreadsheet, narrowed to one tab when the spreadsheet has several"""
+    result = await db.execute(select(SyncConfig).where(SyncConfig.sheet_id == sheet_id))
+    configs = result.scalars().all()
+    if len(configs) > 1 and sheet_name:
+        configs = [config for config in configs if config.sheet_name == sheet_name]
+    if not configs:
+        raise HTTPException(status_code=404, detail=f"No sync config found for sheet {sheet_id}")
+    return configs[0]
+
+async def _deduplicated(endpoint: str, key: Optional[str], handler):
+    """Run a webhook handler once per idempotency key; repeats get the first response"""
+    if not key:
+        return await handler()
+    previous = webhook_dedupe.claim(key)
+    if previous is not None:
+        metrics.webhook_duplicates.inc(endpoint=endpoint)
+        if previous is IN_PROGRESS:
+            return {"duplicate": True, "idempotency_key": key, "status": "in_progress"}
+        return {**previous, "duplicate": True}
+    try:
+        response = await handler()
+    except Exception:
+        webhook_dedupe.release(key)
+        raise
+    webhook_dedupe.complete(key, response)
+    return response
+
 @app.post("/apps-script-sync")
-async def apps_script_sync(request: dict, db: AsyncSession = Depends(get_db)):
+async def apps_script_sync(request: dict, db: AsyncSession = Depends(get_db),
+                           idempotency_key: Optional[str] = Header(None)):
     """Handle sync requests from Google Apps Script"""
+    key = idempotency_key or request.get("idempotency_key")
+    return await _deduplicated("/apps-script-sync", key, lambda: _admitted(
+        "/apps-script-sync", request.get("sheet_id"), lambda: _apps_script_sync(request, db)
+    ))
+
+async def _apps_script_sync(request: dict, db: AsyncSession):
     try:
         sheet_id = request.get("sheet_id")
         edit_info = request.get("edit_info", {})
         trigger_source = request.get("trigger_source", "apps_script")
         
         # Find matching sync config
-        result = await db.execute(select(SyncConfig).where(SyncConfig.sheet_id == sheet_id))
-        config = result.scalar_one_or_none()
+        config = await _find_config(db, sheet_id, edit_info.get("sheet"))
         
-        if not config:
-            raise HTTPException(status_code=404, detail=f"No sync config found for sheet {sheet_id}")
+        # An edit means this sheet is active again; poll it at the fast cadence
+        sync_service.notify_change(config.id)
         
         # Log the Apps Script trigger
         import logging
@@ -147,19 +309,12 @@ async def apps_script_sync(request: dict, db: AsyncSession = Depends(get_db)):
         # Determine sync direction based on edit type
         edit_type = edit_info.get("editType", "EDIT")
         
-        if edit_type in ["EDIT", "STRUCTURE_CHANGE"]:
-            # Sheet was edited, sync Sheet → DB first, then DB → Sheet for consistency
-            await sync_service._sync_sheet_to_db(config)
-            # Small delay to ensure consistency
-            import asyncio
-            await asyncio.sleep(0.5)
-            await sync_service._sync_db_to_sheet(config)
-            
-        elif edit_type == "MANUAL":
-            # Manual trigger, do full bidirectional sync
-            await sync_service._sync_sheet_to_db(config)
-            await asyncio.sleep(0.5)
-            await sync_service._sync_db_to_sheet(config)
+        if edit_type in ["EDIT", "STRUCTURE_CHANGE", "MANUAL"]:
+            # Sheet was edited (or a manual trigger): sync Sheet → DB first, then DB → Sheet for consistency
+            changed = await sync_service.sync_config(config, force=True, lane="interactive")
+            if changed is None:
+                # Another pass kept the lock past the wait; let Apps Script retry
+                raise HTTPException(status_code=503, detail=f"Sync for {config.id} is busy, retry later")
         
         return {
             "message": "Apps Script sync completed successfully",
@@ -169,20 +324,149 @@ async def apps_script_sync(request: dict, db: AsyncSession = Depends(get_db)):
             "timestamp": request.get("timestamp")
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         import logging
         logger = logging.getLogger(__name__)
         logger.error(f"Apps Script sync failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _apply_tab_deltas(db: AsyncSession, sheet_id: str, batch):
+    config = await _find_config(db, sheet_id, batch.sheet)
+    if config.sheet_name != batch.sheet:
+        raise HTTPException(status_code=404, detail=f"Tab {batch.sheet} is not synced")
+    
+    try:
+        result = await sync_service.apply_deltas(config, batch.seq, [delta.model_dump() for delta in batch.deltas])
+    except SyncBusy as e:
+        # Another pass kept the lock past the wait; let Apps Script retry
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        import logging
+        logger = logging.getLogger(__name__)
+        logger.error(f"Applying delta batch {batch.seq} for {config.id} failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    if result["status"] != "duplicate":
+        # An edit means this sheet is active again; poll it at the fast cadence
+        sync_service.notify_change(config.id)
+    return {"config_id": config.id, "sheet": batch.sheet, "seq": batch.seq, **result}
+
+@app.post("/apps-script-delta")
+async def apps_script_delta(batch: DeltaBatch, db: AsyncSession = Depends(get_db),
+                            idempotency_key: Optional[str] = Header(None)):
+    """Apply edited cell values sent by Apps Script directly to MySQL"""
+    if batch.protocol != 1:
+        raise HTTPException(status_code=400, detail=f"Unsupported delta protocol {batch.protocol}")
+    return await _deduplicated("/apps-script-delta", idempotency_key, lambda: _admitted(
+        "/apps-script-delta", batch.sheet_id, lambda: _apply_tab_deltas(db, batch.sheet_id, batch)
+    ))
+
+@app.post("/apps-script-delta/batch")
+async def apps_script_delta_batch(request: DeltaBatchList, db: AsyncSession = Depends(get_db),
+                                  idempotency_key: Optional[str] = Header(None)):
+    """Apply edits buffered by Apps Script, one sequence-numbered batch per tab, in one request"""
+    if request.protocol != 1:
+        raise HTTPException(status_code=400, detail=f"Unsupported delta protocol {request.protocol}")
+    return await _deduplicated("/apps-script-delta/batch", idempotency_key, lambda: _admitted(
+        "/apps-script-delta/batch", request.sheet_id, lambda: _apply_delta_batches(request, db)
+    ))
+
+async def _apply_delta_batches(request: DeltaBatchList, db: AsyncSession):
+    # Tabs are independent, but each tab's batches must be applied in order
+    results = []
+    for batch in request.batches:
+        try:
+            results.append(await _apply_tab_deltas(db, request.sheet_id, batch))
+        except HTTPException as e:
+            if e.status_code != 404:
+                raise
+            # Edits on tabs without a sync config must not fail the other tabs' batches
+            results.append({"sheet": batch.sheet, "seq": batch.seq, "status": "not_synced"})
+    return {
+        "batches": results,
+        "cells": sum(len(row) for batch in request.batches for delta in batch.deltas for row in delta.values)
+    }
+
 @app.get("/health")
 async def health_check():
-    """Health check endpoint for Apps Script testing"""
+    """Liveness based on how recently each sync loop last succeeded"""
+    loops = sync_service.loop_health(HEALTH_STALE_SECONDS)
+    healthy = all(loop["healthy"] for loop in loops)
+    return JSONResponse(
+        status_code=200 if healthy else 503,
+        content={
+            "status": "healthy" if healthy else "degraded",
+            "service": "Superjoin Sync API",
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "stale_after_seconds": HEALTH_STALE_SECONDS,
+            "sync_loops": loops,
+            "pass_requests": sync_service.coalescer.stats,
+            "statement_cache": sync_service.mysql.statements.stats(),
+            "webhook_dedupe": webhook_dedupe.stats(),
+            "sync_lanes": sync_lanes.stats(),
+            "admission": admission.stats(),
+            "event_stream": event_bus.stats(),
+            "apps_script_ready": True
+        }
+    )
+
+@app.get("/events")
+async def event_stream(request: Request, config_id: Optional[str] = None):
+    """Server-sent events for sync activity, optionally limited to one config"""
+    try:
+        subscription = event_bus.subscribe(config_id)
+    except TooManySubscribers as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(EVENTS_KEEPALIVE_SECONDS)})
+    
+    async def stream():
+        try:
+            # Reconnect delay for the browser's EventSource
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                event = await subscription.get(EVENTS_KEEPALIVE_SECONDS)
+                if event is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                event_id = f"id: {event['id']}\n" if "id" in event else ""
+                yield f"{event_id}data: {json.dumps(event)}\n\n"
+        finally:
+            event_bus.unsubscribe(subscription)
+    
+    return StreamingResponse(
+        stream(), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus metrics for the sync engine"""
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/admin/traces")
+async def recent_traces(limit: int = 20):
+    """Recent sync pass traces from the in-process ring buffer"""
+    return {
+        "enabled": tracer.enabled,
+        "otlp_export": tracer.exporter is not None,
+        "traces": tracer.recent(limit)
+    }
+
+@app.get("/admin/workers")
+async def list_workers(db: AsyncSession = Depends(get_db)):
+    """Sharded sync workers and the config leases they hold"""
+    workers = (await db.execute(select(SyncWorker))).scalars().all()
+    leases = (await db.execute(select(SyncLease))).scalars().all()
     return {
-        "status": "healthy",
-        "service": "Superjoin Sync API",
-        "timestamp": "2024-01-12T00:00:00Z",
-        "apps_script_ready": True
+        "sync_mode": SYNC_MODE,
+        "workers": [
+            {"worker_id": w.worker_id, "hostname": w.hostname, "pid": w.pid, "heartbeat_at": w.heartbeat_at}
+            for w in workers
+        ],
+        "leases": [
+            {"config_id": l.config_id, "owner": l.owner, "expires_at": l.expires_at}
+            for l in leases
+        ]
     }
 
 if __name__ == "__main__":
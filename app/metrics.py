@@ -0,0 +1,241 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Config id of the sync pass currently running in this task; lets the
+# Sheets/MySQL services label their counters without threading it through.
+current_config = ContextVar("current_config", default="")
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def config_label():
+    return current_config.get() or "none"
+
+
+@contextmanager
+def config_scope(config_id: str):
+    """Label all metrics recorded inside the block with this config id"""
+    token = current_config.set(config_id)
+    try:
+        yield
+    finally:
+        current_config.reset(token)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, help_text: str, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict):
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        return [
+            f"{self.name}{_format_labels(self.label_names, key)} {value}"
+            for key, value in self._values.items()
+        ]
+
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self):
+        lines = []
+        for key, state in self._values.items():
+            for bound, count in zip(self.buckets, state["counts"]):
+                labels = _format_labels(self.label_names, key, ("le", bound))
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.label_names, key, ("le", "+Inf"))
+            lines.append(f"{self.name}_bucket{labels} {state['count']}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {state['sum']}")
+            lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name: str, help_text: str, labels=()):
+        return self._register(Counter(name, help_text, labels))
+
+    def gauge(self, name: str, help_text: str, labels=()):
+        return self._register(Gauge(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Render every metric in the Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+sync_pass_duration = registry.histogram(
+    "sync_pass_duration_seconds", "Duration of a sync pass", ("config", "direction")
+)
+sync_pass_errors = registry.counter(
+    "sync_pass_errors_total", "Sync passes that raised an error", ("config", "direction")
+)
+sync_last_success = registry.gauge(
+    "sync_last_success_timestamp_seconds", "Unix time of the last successful sync pass", ("config", "direction")
+)
+rows_read = registry.counter(
+    "sync_rows_read_total", "Rows read from the source of a sync pass", ("config", "direction")
+)
+rows_written = registry.counter(
+    "sync_rows_written_total", "Rows written to the target of a sync pass", ("config", "direction")
+)
+rows_deleted = registry.counter(
+    "sync_rows_deleted_total", "Database rows deleted because they left the sheet", ("config",)
+)
+sheets_api_calls = registry.counter(
+    "sheets_api_calls_total", "Google Sheets API requests", ("config", "method")
+)
+sheets_api_errors = registry.counter(
+    "sheets_api_errors_total", "Google Sheets API requests that failed", ("config", "method")
+)
+sync_retries = registry.counter(
+    "sync_retries_total", "Retried operations", ("config", "operation")
+)
+db_statements = registry.counter(
+    "db_statements_total", "SQL statements executed against synced tables", ("config", "statement")
+)
+poll_interval = registry.gauge(
+    "sync_poll_interval_seconds", "Current adaptive polling interval", ("config",)
+)
+probe_results = registry.counter(
+    "sheets_probe_total", "Change probes run before a sheet read (hit = unchanged, read skipped)", ("config", "result")
+)
+probe_hit_ratio = registry.gauge(
+    "sheets_probe_hit_ratio", "Share of change probes that allowed the full read to be skipped", ("config",)
+)
+pipeline_stage_seconds = registry.counter(
+    "sync_pipeline_stage_seconds_total", "Time Sheet→DB pipeline stages spent busy or stalled", ("config", "stage", "state")
+)
+lock_contention = registry.counter(
+    "sync_lock_contention_total", "Sync passes that found the config's pass lock held", ("config", "outcome")
+)
+lock_wait = registry.histogram(
+    "sync_lock_wait_seconds", "Time spent waiting for a contended pass lock", ("config",)
+)
+pass_requests = registry.counter(
+    "sync_pass_requests_total",
+    "Pass requests by outcome: started, deferred into a follow-up, coalesced into one, or skipped",
+    ("config", "outcome")
+)
+statement_cache = registry.counter(
+    "mysql_statement_cache_total", "MySQLService statement cache lookups (hit or miss) and evictions", ("result",)
+)
+schema_changes = registry.counter(
+    "sync_schema_changes_total", "Table columns added, renamed, deprecated or restored after sheet header changes", ("config", "change")
+)
+delta_batches = registry.counter(
+    "sync_delta_batches_total", "Apps Script delta batches by outcome: applied, duplicate or resynced", ("config", "outcome")
+)
+webhook_duplicates = registry.counter(
+    "webhook_duplicates_total", "Webhook deliveries acknowledged without processing because their idempotency key was seen", ("endpoint",)
+)
+lane_wait = registry.histogram(
+    "sync_lane_wait_seconds", "Time a sync pass waited for a slot in its priority lane", ("lane",)
+)
+lane_latency = registry.histogram(
+    "sync_lane_latency_seconds", "Sync request latency per priority lane, slot wait included", ("lane",)
+)
+lane_running = registry.gauge(
+    "sync_lane_running", "Sync passes currently holding a slot, per priority lane", ("lane",)
+)
+admission_requests = registry.counter(
+    "sync_admission_requests_total", "Sync endpoint requests by admission outcome: admitted, endpoint_full or sheet_full", ("endpoint", "outcome")
+)
+event_subscribers = registry.gauge(
+    "sync_event_subscribers", "Clients connected to the live sync event stream"
+)
+events_dropped = registry.counter(
+    "sync_events_dropped_total", "Events dropped from a slow client's buffer on the live event stream"
+)
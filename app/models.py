@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime, Text, Boolean, JSON
+from sqlalchemy import Column, String, DateTime, Text, Boolean, JSON, Integer
 from sqlalchemy.sql import func
 from app.database import Base
 import uuid
@@ -12,4 +12,31 @@ class SyncConfig(Base):
     table_name = Column(String(255), nullable=False)
     column_mapping = Column(JSON, nullable=False)
     is_active = Column(Boolean, default=True)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
\ No newline at end of file
+    # Adaptive polling bounds in seconds; NULL falls back to the global defaults
+    min_sync_interval = Column(Integer, nullable=True)
+    max_sync_interval = Column(Integer, nullable=True)
+    # Only sync the columns named in column_mapping (targeted column reads and writes)
+    strict_columns = Column(Boolean, default=False)
+    # Optional row predicate (see app.filters.RowFilter); only matching rows are synced
+    row_filter = Column(JSON, nullable=True)
+    # Sequence number of the last Apps Script delta batch applied (see /apps-script-delta)
+    delta_seq = Column(Integer, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class SyncWorker(Base):
+    """Heartbeat of a sync worker process; live workers make up the hash ring"""
+    __tablename__ = "sync_workers"
+    
+    worker_id = Column(String(128), primary_key=True)
+    hostname = Column(String(255), nullable=False)
+    pid = Column(Integer, nullable=False)
+    started_at = Column(DateTime, server_default=func.now())
+    heartbeat_at = Column(DateTime, nullable=False)
+
+class SyncLease(Base):
+    """Ownership of a sync config by exactly one worker until expires_at"""
+    __tablename__ = "sync_leases"
+    
+    config_id = Column(String(36), primary_key=True)
+    owner = Column(String(128), nullable=False)
+    expires_at = Column(DateTime, nullable=False)
\ No newline at end of file
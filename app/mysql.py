@@ -1,7 +1,210 @@
-from sqlalchemy import text
+import logging
+import os
+import re
+import tempfile
+from collections import OrderedDict
+from sqlalchemy import bindparam, text
+from sqlalchemy.exc import DBAPIError
 from app.database import engine
+from app import metrics
+from app.tracing import tracer
+from app.config import MYSQL_STATEMENT_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Column comments marking columns this service created for sheet headers, and
+# those whose header was removed from the sheet (the data is kept but the
+# column is no longer written back). Other columns are never altered
+MANAGED_COMMENT = "superjoin:column"
+DEPRECATED_COMMENT = "superjoin:deprecated"
+
+# MySQL error codes
+ER_DUP_FIELDNAME = 1060
+ER_ALTER_OPERATION_NOT_SUPPORTED = 1845
+ER_ALTER_OPERATION_NOT_SUPPORTED_REASON = 1846
+
+def _count_statement(statement: str, amount: int = 1):
+    metrics.db_statements.inc(amount, config=metrics.config_label(), statement=statement)
+
+def _tsv_field(value):
+    """Encode a value for LOAD DATA's default (tab separated, backslash escaped) format"""
+    if value is None:
+        return "\\N"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+def _column_status(comment: str, data_type: str, nullable: str, default):
+    if comment == DEPRECATED_COMMENT:
+        return "deprecated"
+    if comment == MANAGED_COMMENT:
+        return "managed"
+    # Header columns created before they were marked: plain nullable TEXT, no comment
+    if not comment and data_type.lower() == "text" and nullable == "YES" and default is None:
+        return "managed"
+    return None
+
+def _column_definition(create_statement: str, column: str):
+    """A column's definition from SHOW CREATE TABLE output, without its COMMENT clause"""
+    prefix = f"`{column}` "
+    for line in create_statement.splitlines():
+        line = line.strip().rstrip(",")
+        if line.startswith(prefix):
+            return re.sub(r" COMMENT '(?:[^'\\]|\\.|'')*'", "", line)
+    raise ValueError(f"Column {column} not found in table definition")
+
+def _error_code(error: DBAPIError):
+    args = getattr(error.orig, "args", ())
+    return args[0] if args else None
+
+class StatementCache:
+    """
+    LRU cache of built SQL statements keyed by (table, operation, column set)
+    Reusing the same text() construct also lets SQLAlchemy reuse its compiled
+    form, so a hot upsert is only built and compiled once per column set
+    """
+
+    def __init__(self, max_size: int = MYSQL_STATEMENT_CACHE_SIZE):
+        self.max_size = max_size
+        self._statements = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, table_name: str, operation: str, columns, build):
+        """Return the cached statement, calling build() to create it on a miss"""
+        key = (table_name, operation, tuple(columns))
+        statement = self._statements.get(key)
+        if statement is not None:
+            self._statements.move_to_end(key)
+            self.hits += 1
+            metrics.statement_cache.inc(result="hit")
+            return statement
+        
+        self.misses += 1
+        metrics.statement_cache.inc(result="miss")
+        statement = self._statements[key] = build()
+        if len(self._statements) > self.max_size:
+            self._statements.popitem(last=False)
+            self.evictions += 1
+            metrics.statement_cache.inc(result="evicted")
+        return statement
+
+    def invalidate(self, table_name: str):
+        """Forget every statement built for a table, e.g. after its schema changed"""
+        for key in [key for key in self._statements if key[0] == table_name]:
+            del self._statements[key]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._statements),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+        }
 
 class MySQLService:
+    def __init__(self):
+        self.statements = StatementCache()
+        self.schemas = {}
+    
+    async def _load_schema(self, table_name: str):
+        """
+        Column name → status in definition order, cached until the table's schema changes
+        Status is "deprecated", "managed" (a header column this service created)
+        or None for every other column
+        """
+        schema = self.schemas.get(table_name)
+        if schema is not None:
+            return schema
+        
+        with tracer.span("mysql.introspect", table=table_name):
+            async with engine.connect() as conn:
+                result = await conn.execute(text("""
+                    SELECT COLUMN_NAME, COLUMN_COMMENT, DATA_TYPE, IS_NULLABLE, COLUMN_DEFAULT
+                    FROM information_schema.COLUMNS
+                    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table_name
+                    ORDER BY ORDINAL_POSITION
+                """), {"table_name": table_name})
+                _count_statement("select")
+                schema = {row[0]: _column_status(*row[1:]) for row in result.fetchall()}
+        if schema:
+            self.schemas[table_name] = schema
+        return schema
+    
+    async def get_columns(self, table_name: str, include_deprecated: bool = True):
+        """Column names of a table in definition order, from the cached schema"""
+        schema = await self._load_schema(table_name)
+        return [name for name, status in schema.items() if include_deprecated or status != "deprecated"]
+    
+    async def get_deprecated_columns(self, table_name: str):
+        schema = await self._load_schema(table_name)
+        return [name for name, status in schema.items() if status == "deprecated"]
+    
+    async def get_managed_columns(self, table_name: str):
+        """Header columns this service created (deprecated or not); the only ones it may deprecate"""
+        schema = await self._load_schema(table_name)
+        return [name for name, status in schema.items() if status is not None]
+    
+    async def add_column(self, table_name: str, column: str):
+        """
+        Add a nullable TEXT column without rebuilding the table
+        Uses ALGORITHM=INSTANT where the server supports it and falls back to
+        the default online DDL otherwise. A column that already exists (e.g.
+        added by another instance) is not an error
+        """
+        statement = f"ALTER TABLE `{table_name}` ADD COLUMN `{column}` TEXT NULL COMMENT '{MANAGED_COMMENT}'"
+        with tracer.span("mysql.add_column", table=table_name, column=column):
+            try:
+                try:
+                    async with engine.begin() as conn:
+                        await conn.execute(text(f"{statement}, ALGORITHM=INSTANT"))
+                except DBAPIError as e:
+                    if _error_code(e) not in (ER_ALTER_OPERATION_NOT_SUPPORTED, ER_ALTER_OPERATION_NOT_SUPPORTED_REASON):
+                        raise
+                    logger.info(f"INSTANT ADD COLUMN not supported for {table_name}, using online DDL")
+                    async with engine.begin() as conn:
+                        await conn.execute(text(statement))
+                _count_statement("ddl")
+            except DBAPIError as e:
+                if _error_code(e) != ER_DUP_FIELDNAME:
+                    raise
+            finally:
+                self._schema_changed(table_name)
+    
+    async def set_column_deprecated(self, table_name: str, column: str, deprecated: bool):
+        """
+        Mark or unmark a column as deprecated through its comment (a metadata-only change)
+        The column's own definition is read back from SHOW CREATE TABLE and
+        re-emitted with only the comment swapped, so type, nullability and
+        default are untouched
+        """
+        comment = DEPRECATED_COMMENT if deprecated else MANAGED_COMMENT
+        with tracer.span("mysql.deprecate_column", table=table_name, column=column, deprecated=deprecated):
+            async with engine.begin() as conn:
+                result = await conn.execute(text(f"SHOW CREATE TABLE `{table_name}`"))
+                _count_statement("select")
+                definition = _column_definition(result.fetchone()[1], column)
+                # Sent as-is: the definition may quote defaults containing ':' or '%'
+                await conn.exec_driver_sql(
+                    f"ALTER TABLE `{table_name}` MODIFY COLUMN {definition} COMMENT '{comment}'",
+                    execution_options={"no_parameters": True}
+                )
+                _count_statement("ddl")
+        self._schema_changed(table_name)
+    
+    def _schema_changed(self, table_name: str):
+        """Drop cached schema and statements after DDL on a table"""
+        self.schemas.pop(table_name, None)
+        self.statements.invalidate(table_name)
+    
     async def create_table(self, table_name: str, headers: list):
         # Remove duplicates and clean headers
         unique_headers = []
@@ -22,7 +225,7 @@ class MySQLService:
             seen.add(clean_header)
         
         # Create table with proper MySQL syntax + sheet_row_id for sync mapping
-        columns = ", ".join([f"`{header}` TEXT" for header in unique_headers])
+        columns = ", ".join([f"`{header}` TEXT COMMENT '{MANAGED_COMMENT}'" for header in unique_headers])
         query = f"""
             CREATE TABLE IF NOT EXISTS `{table_name}` (
                 id INT AUTO_INCREMENT PRIMARY KEY,
@@ -31,108 +234,195 @@ class MySQLService:
                 UNIQUE KEY unique_sheet_row (sheet_row_id)
             ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
         """
-        async with engine.begin() as conn:
-            await conn.execute(text(query))
+        with tracer.span("mysql.create_table", table=table_name, columns=len(unique_headers)):
+            async with engine.begin() as conn:
+                await conn.execute(text(query))
+                _count_statement("ddl")
+        self._schema_changed(table_name)
     
     async def get_data(self, table_name: str):
-        query = f"SELECT * FROM `{table_name}`"
+        query = self.statements.get(table_name, "select", (), lambda: text(f"SELECT * FROM `{table_name}`"))
         async with engine.begin() as conn:
-            result = await conn.execute(text(query))
+            result = await conn.execute(query)
+            _count_statement("select")
             columns = result.keys()
             rows = result.fetchall()
             return [dict(zip(columns, row)) for row in rows]
     
-    async def get_all_data(self, table_name: str):
-        """Get all data from a table"""
-        query = f"SELECT * FROM `{table_name}` ORDER BY id"
-        async with engine.begin() as conn:
-            result = await conn.execute(text(query))
-            columns = result.keys()
-            rows = result.fetchall()
-            return [dict(zip(columns, row)) for row in rows]
+    async def get_all_data(self, table_name: str, where: str = None, params: dict = None):
+        """Get all data from a table, optionally only rows matching a WHERE condition"""
+        where_sql = f" WHERE {where}" if where else ""
+        query = self.statements.get(
+            table_name, "select_all", (where_sql,), lambda: text(f"SELECT * FROM `{table_name}`{where_sql} ORDER BY id")
+        )
+        with tracer.span("mysql.select_all", table=table_name, filtered=bool(where)) as span:
+            async with engine.begin() as conn:
+                result = await conn.execute(query, params or {})
+                _count_statement("select")
+                columns = result.keys()
+                rows = result.fetchall()
+                span.set_attribute("rows", len(rows))
+                return [dict(zip(columns, row)) for row in rows]
+    
+    async def iter_rows(self, table_name: str, columns: list, order_by: str = "id", after: int = None,
+                        limit: int = 100, where: str = None, params: dict = None):
+        """
+        Yield up to `limit` rows ordered by order_by (id or sheet_row_id, both
+        indexed), starting after the keyset cursor `after`. Rows come from a
+        server-side cursor, so a page is never held in memory as a whole
+        """
+        conditions = ([f"`{order_by}` > :after"] if after is not None else []) + ([f"({where})"] if where else [])
+        where_sql = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        select_list = ", ".join(f"`{column}`" for column in columns)
+        params = {**(params or {}), "limit": limit}
+        if after is not None:
+            params["after"] = after
+        query = self.statements.get(
+            table_name, "browse", (order_by, where_sql, *columns),
+            lambda: text(f"SELECT {select_list} FROM `{table_name}`{where_sql} ORDER BY `{order_by}` LIMIT :limit")
+        )
+        with tracer.span("mysql.browse", table=table_name, limit=limit, filtered=bool(where)) as span:
+            async with engine.connect() as conn:
+                result = await conn.stream(query, params)
+                _count_statement("select")
+                count = 0
+                async for row in result:
+                    count += 1
+                    yield dict(zip(columns, row))
+                span.set_attribute("rows", count)
     
     async def clear_and_insert(self, table_name: str, data: list):
+        """
+        Replace a table's contents without locking it for the reload
+        Rows go into a fresh shadow copy of the table (so AUTO_INCREMENT
+        restarts at 1), which then atomically replaces the live table
+        """
         if not data:
             return
         
-        async with engine.begin() as conn:
-            # Clear table
-            await conn.execute(text(f"DELETE FROM `{table_name}`"))
-            
-            # Reset auto-increment counter for MySQL
-            await conn.execute(text(f"ALTER TABLE `{table_name}` AUTO_INCREMENT = 1"))
-            
-            # Insert new data (exclude 'id' column to let auto-increment work)
-            columns = [col for col in data[0].keys() if col != 'id']
-            if not columns:
-                return
+        # Insert new data (exclude 'id' column to let auto-increment work)
+        columns = [col for col in data[0].keys() if col != 'id']
+        if not columns:
+            return
+        
+        shadow_table = f"{table_name}__shadow"
+        with tracer.span("mysql.clear_and_insert", table=table_name, rows=len(data)):
+            try:
+                async with engine.begin() as conn:
+                    await self._create_copy(conn, table_name, shadow_table)
+                    
+                    query = self.statements.get(shadow_table, "insert", columns, lambda: text(f"""
+                        INSERT INTO `{shadow_table}` ({', '.join([f'`{col}`' for col in columns])})
+                        VALUES ({', '.join([f':{col}' for col in columns])})
+                    """))
+                    # Prepare data without 'id' column
+                    clean_data = [{col: row.get(col) for col in columns} for row in data]
+                    await conn.execute(query, clean_data)
+                    _count_statement("insert")
                 
-            placeholders = [f":{col}" for col in columns]
-            query = f"""
-                INSERT INTO `{table_name}` ({', '.join([f'`{col}`' for col in columns])})
-                VALUES ({', '.join(placeholders)})
-            """
-            
-            # Prepare data without 'id' column
-            clean_data = []
-            for row in data:
-                clean_row = {col: row[col] for col in columns if col in row}
-                clean_data.append(clean_row)
-            
-            if clean_data:
-                await conn.execute(text(query), clean_data)
+                await self._swap_in(table_name, shadow_table)
+            finally:
+                async with engine.begin() as conn:
+                    await conn.execute(text(f"DROP TABLE IF EXISTS `{shadow_table}`"))
     
-    async def upsert_data_with_sheet_row_id(self, table_name: str, data_with_row_ids: list):
+    async def upsert_data_with_sheet_row_id(self, table_name: str, data_with_row_ids: list, conn=None):
         """
         Professional UPSERT using sheet_row_id as deterministic identifier
         data_with_row_ids: [{'sheet_row_id': 2, 'Name': 'John', 'Email': 'john@test.com', ...}, ...]
+        Rows may carry only some columns; the others keep their values.
+        Pass conn to run inside the caller's transaction
         """
         if not data_with_row_ids:
-            return
+            return 0
         
-        async with engine.begin() as conn:
+        if conn is None:
+            async with engine.begin() as conn:
+                return await self.upsert_data_with_sheet_row_id(table_name, data_with_row_ids, conn)
+        
+        written = 0
+        with tracer.span("mysql.upsert", table=table_name, rows=len(data_with_row_ids)) as span:
             for row_data in data_with_row_ids:
                 if 'sheet_row_id' not in row_data:
                     continue
-                
+            
                 # Separate sheet_row_id from other columns
                 sheet_row_id = row_data['sheet_row_id']
                 columns = [col for col in row_data.keys() if col not in ['id', 'sheet_row_id']]
-                
+            
                 if not columns:
                     continue
-                
-                # Build INSERT ... ON DUPLICATE KEY UPDATE query
-                column_list = ['sheet_row_id'] + columns
-                placeholders = [':sheet_row_id'] + [f':{col}' for col in columns]
-                update_clause = ", ".join([f"`{col}` = VALUES(`{col}`)" for col in columns])
-                
-                query = f"""
-                    INSERT INTO `{table_name}` ({', '.join([f'`{col}`' for col in column_list])})
-                    VALUES ({', '.join(placeholders)})
-                    ON DUPLICATE KEY UPDATE {update_clause}
-                """
-                
+            
+                # Build INSERT ... ON DUPLICATE KEY UPDATE query (once per column set)
+                query = self.statements.get(table_name, "upsert", columns, lambda: self._build_upsert(table_name, columns))
+            
                 # Prepare data for query
                 query_data = {'sheet_row_id': sheet_row_id}
                 for col in columns:
                     query_data[col] = row_data.get(col, '')
-                
-                await conn.execute(text(query), query_data)
+            
+                await conn.execute(query, query_data)
+                _count_statement("upsert")
+                written += 1
+            span.set_attribute("written", written)
+        
+        return written
+    
+    @staticmethod
+    def _build_upsert(table_name: str, columns: list):
+        column_list = ['sheet_row_id'] + columns
+        placeholders = [':sheet_row_id'] + [f':{col}' for col in columns]
+        update_clause = ", ".join([f"`{col}` = VALUES(`{col}`)" for col in columns])
+        return text(f"""
+            INSERT INTO `{table_name}` ({', '.join([f'`{col}`' for col in column_list])})
+            VALUES ({', '.join(placeholders)})
+            ON DUPLICATE KEY UPDATE {update_clause}
+        """)
     
     async def cleanup_deleted_sheet_rows(self, table_name: str, active_sheet_row_ids: list):
         """
         Remove database rows whose sheet_row_id no longer exist in the sheet
         This handles deletions in Google Sheet
+        Returns the number of rows deleted
         """
         if not active_sheet_row_ids:
-            return
+            return 0
         
-        async with engine.begin() as conn:
-            # Convert to comma-separated string for SQL IN clause
-            id_list = ','.join(map(str, active_sheet_row_ids))
-            query = f"DELETE FROM `{table_name}` WHERE sheet_row_id NOT IN ({id_list})"
-            await conn.execute(text(query))
+        with tracer.span("mysql.cleanup", table=table_name, active_rows=len(active_sheet_row_ids)) as span:
+            async with engine.begin() as conn:
+                # Expanding parameter, so one cached statement serves any number of ids
+                query = self.statements.get(table_name, "cleanup", (), lambda: text(
+                    f"DELETE FROM `{table_name}` WHERE sheet_row_id NOT IN :ids"
+                ).bindparams(bindparam("ids", expanding=True)))
+                result = await conn.execute(query, {"ids": list(active_sheet_row_ids)})
+                _count_statement("delete")
+                span.set_attribute("deleted", result.rowcount)
+                return result.rowcount
+    
+    @staticmethod
+    async def _create_copy(conn, table_name: str, copy_table: str):
+        """(Re)create an empty table with the same definition as table_name"""
+        await conn.execute(text(f"DROP TABLE IF EXISTS `{copy_table}`"))
+        await conn.execute(text(f"CREATE TABLE `{copy_table}` LIKE `{table_name}`"))
+        _count_statement("ddl", 2)
+    
+    async def _swap_in(self, table_name: str, replacement_table: str, conn=None):
+        """
+        Put replacement_table in place of table_name
+        RENAME TABLE swaps both names in one atomic step, so readers see either
+        the old rows or the new ones and never an empty table
+        """
+        if conn is None:
+            async with engine.begin() as conn:
+                return await self._swap_in(table_name, replacement_table, conn)
+        
+        old_table = f"{table_name}__old"
+        await conn.execute(text(f"DROP TABLE IF EXISTS `{old_table}`"))
+        await conn.execute(text(
+            f"RENAME TABLE `{table_name}` TO `{old_table}`, `{replacement_table}` TO `{table_name}`"
+        ))
+        await conn.execute(text(f"DROP TABLE `{old_table}`"))
+        _count_statement("ddl", 3)
+        self._schema_changed(table_name)
     
     async def create_unique_index(self, table_name: str, column: str):
         """Create unique index for upsert operations"""
@@ -140,6 +430,79 @@ class MySQLService:
             query = f"CREATE UNIQUE INDEX idx_{table_name}_{column} ON `{table_name}` (`{column}`)"
             async with engine.begin() as conn:
                 await conn.execute(text(query))
+                _count_statement("ddl")
         except Exception:
             # Index might already exist, ignore error
-            pass
\ No newline at end of file
+            pass
+    
+    async def bulk_load(self, table_name: str, blocks, replace: bool = False):
+        """
+        Bulk load rows (an async iterable of lists of row dicts) into a table
+        Rows are streamed into a temporary TSV file, loaded into a staging copy
+        of the table with LOAD DATA LOCAL INFILE, then swapped in if the table
+        is empty or replace is set, and merged with an upsert otherwise.
+        Returns the rows loaded
+        """
+        staging_table = f"{table_name}__staging"
+        columns = None
+        loaded = 0
+        
+        with tracer.span("mysql.bulk_load", table=table_name) as span:
+            fd, path = tempfile.mkstemp(prefix=f"{table_name}_", suffix=".tsv")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8", newline="") as tsv:
+                    async for rows in blocks:
+                        for row in rows:
+                            if columns is None:
+                                columns = [col for col in row.keys() if col != 'id']
+                            tsv.write("\t".join(_tsv_field(row.get(col)) for col in columns) + "\n")
+                            loaded += 1
+                span.set_attribute("rows", loaded)
+                if not loaded:
+                    return 0
+                
+                column_list = ", ".join(f"`{col}`" for col in columns)
+                async with engine.begin() as conn:
+                    await self._create_copy(conn, table_name, staging_table)
+                    # The file name has to be a literal; the driver quotes the bound value
+                    await conn.execute(
+                        text(f"""
+                            LOAD DATA LOCAL INFILE :path INTO TABLE `{staging_table}`
+                            CHARACTER SET utf8mb4
+                            FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\'
+                            LINES TERMINATED BY '\\n'
+                            ({column_list})
+                        """),
+                        {"path": path}
+                    )
+                    _count_statement("load_data")
+                
+                if replace:
+                    await self._swap_in(table_name, staging_table)
+                else:
+                    await self._merge_staging(table_name, staging_table, columns)
+                logger.info(f"Bulk loaded {loaded} rows into {table_name}")
+                return loaded
+            finally:
+                os.unlink(path)
+                async with engine.begin() as conn:
+                    await conn.execute(text(f"DROP TABLE IF EXISTS `{staging_table}`"))
+    
+    async def _merge_staging(self, table_name: str, staging_table: str, columns: list):
+        """Move a loaded staging table into place: swap when the target is empty, upsert otherwise"""
+        async with engine.begin() as conn:
+            result = await conn.execute(text(f"SELECT 1 FROM `{table_name}` LIMIT 1"))
+            _count_statement("select")
+            target_empty = result.first() is None
+            
+            if target_empty:
+                await self._swap_in(table_name, staging_table, conn)
+            else:
+                column_list = ", ".join(f"`{col}`" for col in columns)
+                update_clause = ", ".join(f"`{col}` = VALUES(`{col}`)" for col in columns if col != 'sheet_row_id')
+                await conn.execute(text(f"""
+                    INSERT INTO `{table_name}` ({column_list})
+                    SELECT {column_list} FROM `{staging_table}`
+                    ON DUPLICATE KEY UPDATE {update_clause}
+                """))
+                _count_statement("upsert")
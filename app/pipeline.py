@@ -0,0 +1,116 @@
+import asyncio
+import time
+from app.config import SYNC_PIPELINE_QUEUE_SIZE
+
+_END = object()
+
+
+class StageStats:
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.busy = 0.0
+        # Time spent waiting for input from upstream / for room downstream
+        self.starved = 0.0
+        self.blocked = 0.0
+
+    def to_dict(self):
+        return {
+            "items": self.items,
+            "busy_seconds": round(self.busy, 4),
+            "stalled_seconds": round(self.starved + self.blocked, 4),
+            "starved_seconds": round(self.starved, 4),
+            "blocked_seconds": round(self.blocked, 4),
+        }
+
+
+class Pipeline:
+    """
+    Async stages connected by bounded queues
+    The source feeds items through each stage in order; a full queue makes the
+    upstream stage wait (backpressure), so at most queue_size items sit between
+    any two stages while every stage works on its own item concurrently
+    """
+
+    def __init__(self, queue_size: int = SYNC_PIPELINE_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._source = None
+        self._stages = []
+        self.stats = {}
+
+    def source(self, name: str, iterable):
+        """Async iterable producing the items (e.g. sheet row blocks)"""
+        self._source = (name, iterable)
+        self.stats[name] = StageStats(name)
+        return self
+
+    def stage(self, name: str, handler, on_finish=None):
+        """
+        Add a stage; handler(item) returns the item for the next stage, or None
+        to drop it. on_finish() runs once the stage has seen every item
+        """
+        self._stages.append((name, handler, on_finish))
+        self.stats[name] = StageStats(name)
+        return self
+
+    async def _run_source(self, name: str, iterable, output: asyncio.Queue):
+        stats = self.stats[name]
+        iterator = iterable.__aiter__()
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    item = await iterator.__anext__()
+                except StopAsyncIteration:
+                    break
+                stats.busy += time.perf_counter() - started
+                stats.items += 1
+                started = time.perf_counter()
+                await output.put(item)
+                stats.blocked += time.perf_counter() - started
+        finally:
+            if hasattr(iterator, "aclose"):
+                await iterator.aclose()
+        await output.put(_END)
+
+    async def _run_stage(self, name: str, handler, on_finish, inbox: asyncio.Queue, outbox):
+        stats = self.stats[name]
+        while True:
+            started = time.perf_counter()
+            item = await inbox.get()
+            stats.starved += time.perf_counter() - started
+            if item is _END:
+                break
+            started = time.perf_counter()
+            result = await handler(item)
+            stats.busy += time.perf_counter() - started
+            stats.items += 1
+            if outbox is not None and result is not None:
+                started = time.perf_counter()
+                await outbox.put(result)
+                stats.blocked += time.perf_counter() - started
+        if on_finish:
+            started = time.perf_counter()
+            await on_finish()
+            stats.busy += time.perf_counter() - started
+        if outbox is not None:
+            await outbox.put(_END)
+
+    async def run(self):
+        """Run every stage to completion; the first failure cancels the others"""
+        queues = [asyncio.Queue(maxsize=self.queue_size) for _ in self._stages]
+        source_name, iterable = self._source
+        coroutines = [self._run_source(source_name, iterable, queues[0])]
+        for i, (name, handler, on_finish) in enumerate(self._stages):
+            outbox = queues[i + 1] if i + 1 < len(queues) else None
+            coroutines.append(self._run_stage(name, handler, on_finish, queues[i], outbox))
+
+        tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        return {name: stats.to_dict() for name, stats in self.stats.items()}
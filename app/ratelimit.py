@@ -0,0 +1,99 @@
+import asyncio
+import random
+import time
+from app.config import (
+    SHEETS_READS_PER_MINUTE, SHEETS_WRITES_PER_MINUTE,
+    SHEETS_READS_PER_MINUTE_PER_SHEET, SHEETS_WRITES_PER_MINUTE_PER_SHEET,
+    SHEETS_BACKOFF_BASE, SHEETS_BACKOFF_CAP
+)
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at rate_per_minute"""
+
+    def __init__(self, rate_per_minute: float, burst: float = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = burst or max(1.0, rate_per_minute / 6.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until one token is available (0 if it is available now)"""
+        self._refill(now)
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds: float):
+        """Hold the bucket empty for a while, e.g. after the server answered 429"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+class SheetsQuotaLimiter:
+    """
+    Read and write budgets for the Sheets API, shared by every SheetsService call
+    A request must get a token from both the project-wide bucket and the bucket
+    of the spreadsheet it targets
+    """
+
+    def __init__(self, reads_per_minute: float, writes_per_minute: float,
+                 reads_per_minute_per_sheet: float, writes_per_minute_per_sheet: float):
+        self.project = {
+            "read": TokenBucket(reads_per_minute),
+            "write": TokenBucket(writes_per_minute),
+        }
+        self.per_sheet_rates = {
+            "read": reads_per_minute_per_sheet,
+            "write": writes_per_minute_per_sheet,
+        }
+        self.sheets = {}
+
+    def _buckets(self, kind: str, sheet_id: str):
+        key = (kind, sheet_id)
+        if key not in self.sheets:
+            self.sheets[key] = TokenBucket(self.per_sheet_rates[kind])
+        return self.project[kind], self.sheets[key]
+
+    async def acquire(self, kind: str, sheet_id: str):
+        """Wait until both the project and the spreadsheet budget allow one request"""
+        buckets = self._buckets(kind, sheet_id)
+        waited = 0.0
+        while True:
+            now = time.monotonic()
+            wait = max(bucket.wait_time(now) for bucket in buckets)
+            if wait <= 0:
+                for bucket in buckets:
+                    bucket.take()
+                return waited
+            waited += wait
+            await asyncio.sleep(wait)
+
+    def penalize(self, kind: str, sheet_id: str, seconds: float):
+        """Stop issuing requests of this kind after a quota error"""
+        for bucket in self._buckets(kind, sheet_id):
+            bucket.pause(seconds)
+
+
+def backoff_delay(attempt: int, retry_after: float = None) -> float:
+    """Exponential backoff with full jitter, never shorter than the server's Retry-After"""
+    delay = random.uniform(0, min(SHEETS_BACKOFF_CAP, SHEETS_BACKOFF_BASE * (2 ** attempt)))
+    if retry_after is not None:
+        delay = retry_after + random.uniform(0, SHEETS_BACKOFF_BASE)
+    return delay
+
+
+sheets_limiter = SheetsQuotaLimiter(
+    SHEETS_READS_PER_MINUTE, SHEETS_WRITES_PER_MINUTE,
+    SHEETS_READS_PER_MINUTE_PER_SHEET, SHEETS_WRITES_PER_MINUTE_PER_SHEET
+)
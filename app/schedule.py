@@ -0,0 +1,37 @@
+from app.config import SYNC_MIN_INTERVAL, SYNC_MAX_INTERVAL, SYNC_BACKOFF_FACTOR
+
+
+class PollSchedule:
+    """
+    Adaptive polling interval for one sync config
+    Backs off exponentially while passes find nothing new (or fail) and
+    snaps back to the minimum as soon as a change is seen
+    """
+
+    def __init__(self, min_interval: float = None, max_interval: float = None, factor: float = SYNC_BACKOFF_FACTOR):
+        self.factor = factor
+        self.interval = 0
+        self.idle_passes = 0
+        self.set_bounds(min_interval, max_interval)
+
+    def set_bounds(self, min_interval: float = None, max_interval: float = None):
+        self.min_interval = min_interval or SYNC_MIN_INTERVAL
+        self.max_interval = max(max_interval or SYNC_MAX_INTERVAL, self.min_interval)
+        self.interval = min(max(self.interval, self.min_interval), self.max_interval)
+
+    def record(self, changed: bool):
+        if changed:
+            self.reset()
+        else:
+            self.idle_passes += 1
+            self._back_off()
+
+    def record_error(self):
+        self._back_off()
+
+    def reset(self):
+        self.idle_passes = 0
+        self.interval = self.min_interval
+
+    def _back_off(self):
+        self.interval = min(self.interval * self.factor, self.max_interval)
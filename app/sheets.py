@@ -1,31 +1,321 @@
 import asyncio
+import collections
+import hashlib
+import json
+import logging
+import threading
+import httplib2
 from google.oauth2.service_account import Credentials
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
-from app.config import GOOGLE_CREDENTIALS_FILE, SCOPES
+from googleapiclient.errors import HttpError
+from app.config import (
+    GOOGLE_CREDENTIALS_FILE, SCOPES, SHEETS_CHANGE_PROBE, SHEETS_CHECKSUM_RANGE, SHEETS_SENTINEL_RANGE,
+    SHEETS_MAX_RETRIES, SHEETS_READ_BLOCK_ROWS, SHEETS_READ_CONCURRENCY
+)
+from app import metrics
+from app.tracing import tracer
+from app.ratelimit import sheets_limiter, backoff_delay
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+def _retry_after(error: HttpError):
+    value = error.resp.get("retry-after") if error.resp is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+def _payload_bytes(values):
+    return sum(len(str(cell)) for row in values for cell in row)
+
+def column_letter(index: int) -> str:
+    """A1 column letter for a 0-based column index (0 → A, 26 → AA)"""
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord("A") + remainder) + letters
+    return letters
+
+def contiguous_runs(indexes) -> list:
+    """Group indexes (columns or row numbers) into contiguous (first, last) runs"""
+    runs = []
+    for index in sorted(set(indexes)):
+        if runs and index == runs[-1][1] + 1:
+            runs[-1] = (runs[-1][0], index)
+        else:
+            runs.append((index, index))
+    return runs
+
+def stitch_columns(parts: list, runs: list) -> list:
+    """Join the row lists read for each column run back into full rows"""
+    widths = [last - first + 1 for first, last in runs]
+    rows = []
+    for i in range(max((len(part) for part in parts), default=0)):
+        row = []
+        for part, width in zip(parts, widths):
+            cells = part[i] if i < len(part) else []
+            row.extend(cells + [""] * (width - len(cells)))
+        rows.append(row)
+    return rows
+
+class DriveVersionProbe:
+    """Drive file version; bumps on any change to the spreadsheet"""
+    # One marker covers every tab, so a multi-tab group needs a single probe
+    spreadsheet_wide = True
+    
+    def __init__(self, sheets):
+        self.sheets = sheets
+        self.drive = build('drive', 'v3', credentials=sheets.credentials)
+    
+    async def marker(self, sheet_id: str, sheet_name: str):
+        # Drive quota is separate from the Sheets budgets, so no kind is passed
+        result = await self.sheets._execute(
+            "drive.files.get",
+            self.drive.files().get(fileId=sheet_id, fields="version"),
+            sheet_id
+        )
+        return result.get("version")
+
+class ChecksumCellProbe:
+    """Edit counter cell maintained by the Apps Script onEdit trigger"""
+    spreadsheet_wide = True
+    
+    def __init__(self, sheets, range_name: str = SHEETS_CHECKSUM_RANGE):
+        self.sheets = sheets
+        self.range_name = range_name
+    
+    async def marker(self, sheet_id: str, sheet_name: str):
+        values = await self.sheets.get_data(sheet_id, self.range_name)
+        return values[0][0] if values and values[0] else None
+
+class SentinelRangeProbe:
+    """Hash of a small range of the synced tab, e.g. the key column"""
+    spreadsheet_wide = False
+    
+    def __init__(self, sheets, range_name: str = SHEETS_SENTINEL_RANGE):
+        self.sheets = sheets
+        self.range_name = range_name
+    
+    async def marker(self, sheet_id: str, sheet_name: str):
+        values = await self.sheets.get_data(sheet_id, f"{sheet_name}!{self.range_name}")
+        return hashlib.blake2b(json.dumps(values).encode(), digest_size=16).hexdigest()
+
+CHANGE_PROBES = {
+    "drive": DriveVersionProbe,
+    "checksum": ChecksumCellProbe,
+    "sentinel": SentinelRangeProbe,
+}
 
 class SheetsService:
     def __init__(self):
         self.credentials = Credentials.from_service_account_file(GOOGLE_CREDENTIALS_FILE, scopes=SCOPES)
         self.service = build('sheets', 'v4', credentials=self.credentials)
+        # httplib2.Http is not thread-safe, so every executor thread gets its own
+        self._local = threading.local()
+        probe_class = CHANGE_PROBES.get(SHEETS_CHANGE_PROBE)
+        self.change_probe = probe_class(self) if probe_class else None
     
-    async def get_data(self, sheet_id: str, range_name: str):
+    async def get_change_marker(self, sheet_id: str, sheet_name: str):
+        """Cheap marker that changes whenever the sheet does; None if no probe is configured"""
+        if not self.change_probe:
+            return None
+        with tracer.span("sheets.probe", probe=SHEETS_CHANGE_PROBE):
+            try:
+                return await self.change_probe.marker(sheet_id, sheet_name)
+            except HttpError as e:
+                refused = e.resp.status == 403 and b"ratelimitexceeded" not in (e.content or b"").lower()
+                if not (refused and isinstance(self.change_probe, DriveVersionProbe)):
+                    raise
+                # Drive API not enabled (or not allowed) for this project; it won't start working mid-run
+                logger.warning(f"Change probe '{SHEETS_CHANGE_PROBE}' was refused (HTTP 403), disabling it: {e}")
+                self.change_probe = None
+                return None
+    
+    def _http(self):
+        """This thread's authorized connection for request.execute"""
+        http = getattr(self._local, "http", None)
+        if http is None:
+            http = self._local.http = AuthorizedHttp(self.credentials, http=httplib2.Http())
+        return http
+    
+    def _run(self, request):
+        return request.execute(http=self._http())
+    
+    async def _execute(self, method: str, request, sheet_id: str, kind: str = None):
+        """
+        Run a Sheets API request in the executor within the shared read/write quota
+        Quota (429) and transient errors are retried with jittered exponential
+        backoff that honors Retry-After; other errors are raised immediately
+        """
+        config = metrics.config_label()
         loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(
-            None,
-            lambda: self.service.spreadsheets().values().get(
-                spreadsheetId=sheet_id, range=range_name
-            ).execute()
-        )
-        return result.get('values', [])
+        for attempt in range(SHEETS_MAX_RETRIES + 1):
+            if kind:
+                await sheets_limiter.acquire(kind, sheet_id)
+            metrics.sheets_api_calls.inc(config=config, method=method)
+            try:
+                return await loop.run_in_executor(None, self._run, request)
+            except HttpError as e:
+                metrics.sheets_api_errors.inc(config=config, method=method)
+                if e.resp.status not in RETRYABLE_STATUSES or attempt == SHEETS_MAX_RETRIES:
+                    raise
+                delay = backoff_delay(attempt, _retry_after(e))
+                if e.resp.status == 429 and kind:
+                    sheets_limiter.penalize(kind, sheet_id, delay)
+                logger.warning(f"{method} got HTTP {e.resp.status}, retrying in {delay:.1f}s")
+            except (OSError, TimeoutError, httplib2.HttpLib2Error) as e:
+                metrics.sheets_api_errors.inc(config=config, method=method)
+                if attempt == SHEETS_MAX_RETRIES:
+                    raise
+                delay = backoff_delay(attempt)
+                logger.warning(f"{method} failed ({e}), retrying in {delay:.1f}s")
+            metrics.sync_retries.inc(config=config, operation=method)
+            await asyncio.sleep(delay)
+    
+    async def get_data(self, sheet_id: str, range_name: str):
+        with tracer.span("sheets.values.get", range=range_name) as span:
+            result = await self._execute(
+                "values.get",
+                self.service.spreadsheets().values().get(
+                    spreadsheetId=sheet_id, range=range_name
+                ),
+                sheet_id, "read"
+            )
+            values = result.get('values', [])
+            if span.recording:
+                span.set_attribute("rows", len(values))
+                span.set_attribute("bytes", _payload_bytes(values))
+            return values
     
     async def update_data(self, sheet_id: str, range_name: str, values):
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(
-            None,
-            lambda: self.service.spreadsheets().values().update(
+        with tracer.span("sheets.values.update", range=range_name, rows=len(values)) as span:
+            if span.recording:
+                span.set_attribute("bytes", _payload_bytes(values))
+            await self._execute(
+                "values.update",
+                self.service.spreadsheets().values().update(
+                    spreadsheetId=sheet_id,
+                    range=range_name,
+                    valueInputOption='RAW',
+                    body={'values': values}
+                ),
+                sheet_id, "write"
+            )
+    
+    async def batch_get(self, sheet_id: str, ranges: list):
+        """Read several ranges (e.g. one per tab) in one request; returns their values in order"""
+        with tracer.span("sheets.values.batchGet", ranges=len(ranges)) as span:
+            result = await self._execute(
+                "values.batchGet",
+                self.service.spreadsheets().values().batchGet(spreadsheetId=sheet_id, ranges=ranges),
+                sheet_id, "read"
+            )
+            values = [value_range.get('values', []) for value_range in result.get('valueRanges', [])]
+            if span.recording:
+                span.set_attribute("rows", sum(len(rows) for rows in values))
+                span.set_attribute("bytes", sum(_payload_bytes(rows) for rows in values))
+            return values
+    
+    async def batch_update(self, sheet_id: str, data: dict):
+        """Write several ranges in one request; data maps range → values"""
+        with tracer.span("sheets.values.batchUpdate", ranges=len(data)) as span:
+            if span.recording:
+                span.set_attribute("rows", sum(len(values) for values in data.values()))
+                span.set_attribute("bytes", sum(_payload_bytes(values) for values in data.values()))
+            await self._execute(
+                "values.batchUpdate",
+                self.service.spreadsheets().values().batchUpdate(
+                    spreadsheetId=sheet_id,
+                    body={
+                        'valueInputOption': 'RAW',
+                        'data': [{'range': range_name, 'values': values} for range_name, values in data.items()]
+                    }
+                ),
+                sheet_id, "write"
+            )
+    
+    async def batch_clear(self, sheet_id: str, ranges: list):
+        with tracer.span("sheets.values.batchClear", ranges=len(ranges)):
+            await self._execute(
+                "values.batchClear",
+                self.service.spreadsheets().values().batchClear(spreadsheetId=sheet_id, body={'ranges': ranges}),
+                sheet_id, "write"
+            )
+    
+    async def clear_data(self, sheet_id: str, range_name: str):
+        with tracer.span("sheets.values.clear", range=range_name):
+            await self._execute(
+                "values.clear",
+                self.service.spreadsheets().values().clear(spreadsheetId=sheet_id, range=range_name, body={}),
+                sheet_id, "write"
+            )
+    
+    async def get_row_count(self, sheet_id: str, sheet_name: str):
+        """Number of rows in the tab's grid (including empty trailing rows)"""
+        result = await self._execute(
+            "spreadsheets.get",
+            self.service.spreadsheets().get(
                 spreadsheetId=sheet_id,
-                range=range_name,
-                valueInputOption='RAW',
-                body={'values': values}
-            ).execute()
-        )
\ No newline at end of file
+                fields="sheets(properties(title,gridProperties(rowCount)))"
+            ),
+            sheet_id, "read"
+        )
+        for sheet in result.get("sheets", []):
+            properties = sheet.get("properties", {})
+            if properties.get("title") == sheet_name:
+                return properties.get("gridProperties", {}).get("rowCount", 0)
+        raise ValueError(f"Sheet tab {sheet_name} not found in {sheet_id}")
+    
+    async def _get_projected(self, sheet_id: str, sheet_name: str, runs: list, start: int, end: int):
+        """Read only the given column runs of rows start..end with one batchGet"""
+        parts = await self.batch_get(sheet_id, [
+            f"{sheet_name}!{column_letter(first)}{start}:{column_letter(last)}{end}" for first, last in runs
+        ])
+        return stitch_columns(parts, runs)
+    
+    async def iter_row_blocks(self, sheet_id: str, sheet_name: str, first_column: str = "A", last_column: str = "Z",
+                              block_rows: int = SHEETS_READ_BLOCK_ROWS, concurrency: int = SHEETS_READ_CONCURRENCY,
+                              runs: list = None):
+        """
+        Stream a tab as (first_row_number, rows) blocks of at most block_rows rows, in order
+        Up to `concurrency` block requests are kept in flight so the consumer can
+        transform and write one block while the next ones are still downloading.
+        runs limits the read to those (first, last) column index runs, whose
+        cells are joined side by side in each returned row. The tab's row count
+        is looked up alongside the first block: values.get drops trailing blank
+        rows, so a short block does not mean the tab ends there
+        """
+        def read(start, end):
+            if runs:
+                return self._get_projected(sheet_id, sheet_name, runs, start, end)
+            return self.get_data(sheet_id, f"{sheet_name}!{first_column}{start}:{last_column}{end}")
+        
+        row_count, rows = await asyncio.gather(
+            self.get_row_count(sheet_id, sheet_name), read(1, block_rows)
+        )
+        yield 1, rows
+        
+        starts = iter(range(block_rows + 1, row_count + 1, block_rows))
+        in_flight = collections.deque()
+        
+        def schedule_next():
+            start = next(starts, None)
+            if start is None:
+                return
+            in_flight.append((start, asyncio.ensure_future(read(start, min(start + block_rows - 1, row_count)))))
+        
+        try:
+            for _ in range(max(1, concurrency)):
+                schedule_next()
+            while in_flight:
+                start, request = in_flight.popleft()
+                rows = await request
+                schedule_next()
+                yield start, rows
+        finally:
+            for _, request in in_flight:
+                request.cancel()
@@ -1,25 +1,74 @@
 import asyncio
+import hashlib
+import json
 import logging
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import or_, select, update
 from app.models import SyncConfig
-from app.sheets import SheetsService
+from app.sheets import SheetsService, column_letter, contiguous_runs, stitch_columns
 from app.mysql import MySQLService
+from app import metrics
+from app.tracing import tracer
+from app.schedule import PollSchedule
+from app.pipeline import Pipeline
+from app.filters import RowFilter
+from app.locks import pass_lock, LockNotAcquired, PassCoalescer
+from app.lanes import sync_lanes, LANES
+from app.events import event_bus
+from app.config import (
+    SYNC_MODE, SYNC_LOCK_POLICY, SYNC_LOCK_POLICY_POLL, BULK_LOAD_MIN_ROWS, SYNC_SCHEMA_EVOLUTION,
+    SHEETS_READ_BLOCK_ROWS
+)
+
+SYNC_DIRECTIONS = ("sheet_to_db", "db_to_sheet")
+# Columns every synced table has that never appear in the sheet
+INTERNAL_COLUMNS = ("id", "sheet_row_id")
+# Applied delta batches remembered per config to recognize a replayed seq
+RECENT_DELTA_BATCHES = 32
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class SchemaMismatch(ValueError):
+    pass
+
+class SyncBusy(Exception):
+    """A pass could not run because another one kept the config's lock"""
+
+async def _single_block(rows: list):
+    """Pipeline source for a tab that was already read in full"""
+    yield 1, rows
+
 class SyncService:
     def __init__(self):
         self.sheets = SheetsService()
         self.mysql = MySQLService()
         self.tasks = {}
-        self.sync_interval = 10  # seconds
+        self.schedules = {}
+        self.wake_events = {}
+        self.fingerprints = {}
+        self.probe_markers = {}
+        self.coalescer = PassCoalescer(SYNC_DIRECTIONS)
+        self.loop_started = {}
+        self.loop_last_success = {}
+        self.sheet_row_counts = {}
+        self.sheet_headers = {}
+        self.group_passes = {}
+        self.initial_loads = {}
+        self.tab_rows_read = {}
+        self.recent_deltas = {}
     
-    async def create_sync(self, db: AsyncSession, sheet_id: str, sheet_name: str, table_name: str, column_mapping: dict):
+    async def create_sync(self, db: AsyncSession, sheet_id: str, sheet_name: str, table_name: str, column_mapping: dict,
+                          min_sync_interval: int = None, max_sync_interval: int = None,
+                          bulk_initial_load: bool = True, strict_columns: bool = False, row_filter: list = None):
         try:
+            parsed_filter = RowFilter(row_filter)  # Reject malformed filters before touching the sheet
+            
             # Validate Google Sheet access
             sheet_data = await self.sheets.get_data(sheet_id, f"{sheet_name}!1:1")
             if not sheet_data:
@@ -28,24 +77,60 @@ class SyncService:
             headers = sheet_data[0]
             logger.info(f"Found sheet headers: {headers}")
             
-            # Create database table
-            await self.mysql.create_table(table_name, headers)
-            logger.info(f"Created/verified table: {table_name}")
-            
-            # Save config
             config = SyncConfig(
                 sheet_id=sheet_id,
                 sheet_name=sheet_name,
                 table_name=table_name,
-                column_mapping=column_mapping
+                column_mapping=column_mapping,
+                min_sync_interval=min_sync_interval,
+                max_sync_interval=max_sync_interval,
+                strict_columns=strict_columns,
+                row_filter=row_filter
             )
+            
+            # Columns are named the way sync passes write them; strict_columns
+            # tables only get the mapped columns, under their mapped names
+            columns = [
+                self._db_column(config, header) for header in headers
+                if not strict_columns or str(header).strip() in column_mapping
+            ]
+            columns = [column for column in columns if column]
+            if strict_columns and not columns:
+                raise ValueError("strict_columns needs column_mapping to name at least one sheet header")
+            
+            # Create database table
+            await self.mysql.create_table(table_name, columns)
+            logger.info(f"Created/verified table: {table_name}")
+            
+            # A filter on a missing column would break every pass in both directions
+            table_columns = {column.lower(): column for column in await self.mysql.get_columns(table_name)}
+            unknown = [column for column, _, _ in parsed_filter.conditions if column.lower() not in table_columns]
+            if unknown:
+                raise ValueError(f"Row filter names columns not in {table_name}: {', '.join(unknown)}")
+            if row_filter:
+                # Stored under the table's own spelling, which is how rows are keyed
+                config.row_filter = [
+                    {**condition, "column": table_columns[condition["column"].lower()]} for condition in row_filter
+                ]
+            
+            # Save config
             db.add(config)
             await db.commit()
             await db.refresh(config)
+            event_bus.publish("config_created", config_id=config.id, sheet_name=config.sheet_name,
+                              table_name=config.table_name)
+            
+            # Large sheets get their first copy through LOAD DATA instead of row
+            # upserts; that can take minutes, so it runs after the response
+            if bulk_initial_load:
+                task = asyncio.create_task(self._initial_load_then_start(config))
+                self.initial_loads[config.id] = task
+                task.add_done_callback(lambda _: self.initial_loads.pop(config.id, None))
+                return config
             
-            # Start sync task for real-time sync
-            self.tasks[config.id] = asyncio.create_task(self._sync_loop(config.id))
-            logger.info(f"Started sync loop for config {config.id}")
+            # Start sync task for real-time sync, unless sharded workers own the loops
+            if SYNC_MODE == "embedded":
+                self.start_loop(config.id)
             
             return config
             
@@ -53,19 +138,144 @@ class SyncService:
             logger.error(f"Failed to create sync: {e}")
             raise
     
+    async def _initial_load_then_start(self, config):
+        """Background part of create_sync: the bulk load, then the sync loop"""
+        await self._bulk_initial_load(config)
+        if SYNC_MODE == "embedded":
+            self.start_loop(config.id)
+    
+    async def _bulk_initial_load(self, config):
+        """
+        Load a new config's sheet with MySQLService.bulk_load when it has at least
+        BULK_LOAD_MIN_ROWS data rows. Failures are only logged: the regular
+        Sheet→DB pass then does the first load with upserts instead
+        """
+        try:
+            row_count = await self.sheets.get_row_count(config.sheet_id, config.sheet_name)
+            # rowCount is the grid size, so this may include trailing empty rows
+            if row_count - 1 < BULK_LOAD_MIN_ROWS:
+                return
+            
+            # Sharded workers may pick the new config up straight away; hold its pass lock
+            async with pass_lock.hold(config.id), self._track_pass(config, "initial_load"):
+                async def transformed_blocks():
+                    headers = None
+                    async for first_row, block in await self._row_blocks(config):
+                        if headers is None:
+                            headers = block[0] if block else []
+                            block, first_row = block[1:], first_row + 1
+                            # Tables created before header names were normalised need their columns first
+                            await self._reconcile_headers(config, headers)
+                        metrics.rows_read.inc(len(block), config=config.id, direction="initial_load")
+                        yield self._transform_sheet_rows(config, headers, block, first_row)
+                
+                loaded = await self.mysql.bulk_load(config.table_name, transformed_blocks())
+                metrics.rows_written.inc(loaded, config=config.id, direction="initial_load")
+                event_bus.publish("rows_changed", config_id=config.id, direction="initial_load", rows=loaded)
+                logger.info(f"Initial load: {loaded} rows copied into {config.table_name}")
+        except Exception as e:
+            logger.warning(f"Bulk initial load failed for {config.table_name}, leaving it to the sync loop: {e}")
+    
+    def start_loop(self, config_id: str):
+        """Start the polling loop for a config if it is not already running"""
+        task = self.tasks.get(config_id)
+        if task and not task.done():
+            return
+        self.tasks[config_id] = asyncio.create_task(self._sync_loop(config_id))
+        logger.info(f"Started sync loop for config {config_id}")
+    
+    async def stop_loop(self, config_id: str):
+        """Cancel a config's polling loop and wait for it to finish"""
+        task = self.tasks.pop(config_id, None)
+        if not task:
+            return
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        self.loop_started.pop(config_id, None)
+        self.loop_last_success.pop(config_id, None)
+        logger.info(f"Stopped sync loop for config {config_id}")
+    
     async def _sync_loop(self, config_id: str):
-        """Continuous sync loop for real-time updates"""
+        """Continuous sync loop, polling faster while the data is changing"""
         logger.info(f"Starting sync loop for config {config_id}")
+        self.loop_started[config_id] = time.time()
+        schedule = self.schedules.setdefault(config_id, PollSchedule())
+        self.wake_events.setdefault(config_id, asyncio.Event())
         
         while True:
             try:
-                await self._do_sync(config_id)
-                await asyncio.sleep(self.sync_interval)
+                changed = await self._do_sync(config_id)
+                schedule.record(changed)
             except Exception as e:
                 logger.error(f"Sync loop error for {config_id}: {e}")
-                await asyncio.sleep(30)  # Wait longer on error
+                schedule.record_error()
+            
+            metrics.poll_interval.set(schedule.interval, config=config_id)
+            await self._wait_for_next_pass(config_id, schedule)
+    
+    async def _wait_for_next_pass(self, config_id: str, schedule: PollSchedule):
+        """Sleep for the current interval, shortened if notify_change() fires meanwhile"""
+        event = self.wake_events[config_id]
+        started = time.monotonic()
+        deadline = started + schedule.interval
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                await asyncio.wait_for(event.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                return
+            event.clear()
+            deadline = min(deadline, started + schedule.interval)
+    
+    def notify_change(self, config_id: str):
+        """Snap a config back to its fastest polling cadence (e.g. after a webhook)"""
+        schedule = self.schedules.get(config_id)
+        if schedule:
+            schedule.reset()
+            metrics.poll_interval.set(schedule.interval, config=config_id)
+        event = self.wake_events.get(config_id)
+        if event:
+            event.set()
+    
+    @staticmethod
+    def _fingerprint(data) -> str:
+        return hashlib.blake2b(json.dumps(data, default=str).encode(), digest_size=16).hexdigest()
+    
+    def _fingerprint_changed(self, config_id: str, direction: str, fingerprint: str) -> bool:
+        """Compare a data fingerprint with the one seen on the previous pass"""
+        key = (config_id, direction)
+        changed = self.fingerprints.get(key) != fingerprint
+        self.fingerprints[key] = fingerprint
+        return changed
+    
+    async def _probe_sheet(self, key: str, sheet_id: str, sheet_name: str):
+        """
+        Run the cheap change probe for a config's sheet (or a group's spreadsheet)
+        Returns (marker, unchanged); marker is None when probing is off or failed
+        """
+        try:
+            marker = await self.sheets.get_change_marker(sheet_id, sheet_name)
+        except Exception as e:
+            logger.warning(f"Change probe failed for {key}, doing a full read: {e}")
+            metrics.probe_results.inc(config=key, result="error")
+            return None, False
+        if marker is None:
+            return None, False
+        
+        unchanged = self.probe_markers.get(key) == marker
+        metrics.probe_results.inc(config=key, result="hit" if unchanged else "miss")
+        hits = metrics.probe_results.value(config=key, result="hit")
+        misses = metrics.probe_results.value(config=key, result="miss")
+        metrics.probe_hit_ratio.set(hits / (hits + misses), config=key)
+        return marker, unchanged
     
     async def _do_sync(self, config_id: str):
+        """Run one bidirectional pass; returns True if either side had changes"""
         from app.database import AsyncSessionLocal
         
         async with AsyncSessionLocal() as db:
@@ -73,61 +283,437 @@ class SyncService:
             config = result.scalar_one_or_none()
             
             if not config or not config.is_active:
-                return
+                return False
             
-            try:
-                # BIDIRECTIONAL SYNC
-                await self._sync_sheet_to_db(config)
-                await asyncio.sleep(1)  # Small delay between operations
-                await self._sync_db_to_sheet(config)
-                
-            except Exception as e:
-                logger.error(f"Sync failed for config {config_id}: {e}")
+            schedule = self.schedules[config_id]
+            schedule.set_bounds(config.min_sync_interval, config.max_sync_interval)
+            
+            # Tabs of the same spreadsheet are synced together as one group
+            result = await db.execute(
+                select(SyncConfig)
+                .where(SyncConfig.sheet_id == config.sheet_id, SyncConfig.is_active == True)
+                .order_by(SyncConfig.id)
+            )
+            group = result.scalars().all()
+            
+            if len(group) > 1:
+                changed = await self._do_group_sync(group, schedule)
+            else:
+                # BIDIRECTIONAL SYNC; skipped if another instance is already syncing this config
+                changed = await self.sync_config(config, lock_policy=SYNC_LOCK_POLICY_POLL, lane="background")
+            self.loop_last_success[config_id] = time.time()
+            return bool(changed)
+    
+    async def _do_group_sync(self, group: list, schedule: PollSchedule):
+        """
+        Group pass triggered by one member's loop
+        Every member loop ticks, but the group runs at most once per minimum
+        interval; the others reuse its result so their schedules stay in step
+        """
+        sheet_id = group[0].sheet_id
+        last = self.group_passes.get(sheet_id)
+        if last and time.time() - last[0] < schedule.min_interval:
+            return last[1]
+        changed = await self.sync_group(group, lock_policy=SYNC_LOCK_POLICY_POLL, lane="background")
+        if changed is not None:
+            self.group_passes[sheet_id] = (time.time(), bool(changed))
+        return changed
+    
+    async def sync_config(self, config, directions=SYNC_DIRECTIONS, force: bool = False,
+                          lock_policy: str = SYNC_LOCK_POLICY, lane: str = "manual"):
+        """
+        Run one sync pass for a config
+        Passes for the same config never overlap: within this process, requests
+        made while a pass runs are coalesced into one follow-up pass (or skipped
+        under the "skip" policy), and across instances the pass holds the
+        config's MySQL lock. The pass runs in a slot of its priority lane
+        (interactive, manual or background), a follow-up in the most urgent
+        lane among its requesters. Returns True if anything changed, or None
+        if the pass was skipped
+        """
+        async def run_pass(directions, force):
+            # Only the pass itself holds a slot, not requests waiting to join it
+            async with sync_lanes.slot(lane):
+                return await self._locked_pass(config, directions, force, lock_policy)
+        
+        return await self.coalescer.run(config.id, directions, force, run_pass, wait=lock_policy != "skip",
+                                        priority=LANES.index(lane))
+    
+    async def _locked_pass(self, config, directions, force: bool, lock_policy: str):
+        try:
+            async with pass_lock.hold(config.id, policy=lock_policy):
+                changed = False
+                if "sheet_to_db" in directions:
+                    changed = bool(await self._sync_sheet_to_db(config, force=force)) or changed
+                if "db_to_sheet" in directions:
+                    changed = bool(await self._sync_db_to_sheet(config)) or changed
+                return changed
+        except LockNotAcquired as e:
+            logger.info(f"Skipping sync pass: {e}")
+            return None
+    
+    async def sync_group(self, configs: list, directions=SYNC_DIRECTIONS, force: bool = False,
+                         lock_policy: str = SYNC_LOCK_POLICY, lane: str = "manual"):
+        """
+        Run one pass for every tab of a spreadsheet at once
+        All tabs are read with one batchGet and written back with one
+        batchUpdate, so API calls per pass do not grow with the number of tabs.
+        Holds every member's pass lock; returns True if anything changed, or
+        None if the pass was skipped
+        """
+        sheet_id = configs[0].sheet_id
+        
+        async def run_pass(directions, force):
+            async with sync_lanes.slot(lane):
+                return await self._locked_group_pass(configs, directions, force, lock_policy)
+        
+        return await self.coalescer.run(f"sheet:{sheet_id}", directions, force, run_pass, wait=lock_policy != "skip",
+                                        priority=LANES.index(lane))
     
-    async def _sync_sheet_to_db(self, config):
-        """Sync Google Sheet → Database with sheet_row_id mapping (NO MORE DUPLICATES)"""
+    async def _locked_group_pass(self, configs: list, directions, force: bool, lock_policy: str):
+        sheet_id = configs[0].sheet_id
         try:
-            logger.info(f"Starting Sheet→DB sync for {config.table_name}")
+            # Every tab's lock on one connection, taken in a fixed order
+            async with pass_lock.hold_many([config.id for config in configs], policy=lock_policy):
+                with metrics.config_scope(f"sheet:{sheet_id}"), \
+                        tracer.span("sync.group", sheet_id=sheet_id, tabs=len(configs)):
+                    changed = False
+                    header_rows = {}
+                    if "sheet_to_db" in directions:
+                        changed = await self._group_sheet_to_db(configs, force, header_rows) or changed
+                    if "db_to_sheet" in directions:
+                        changed = await self._group_db_to_sheet(configs, header_rows) or changed
+                    return changed
+        except LockNotAcquired as e:
+            logger.info(f"Skipping group pass for spreadsheet {sheet_id}: {e}")
+            return None
+    
+    async def _group_sheet_to_db(self, configs: list, force: bool, header_rows: dict):
+        """
+        Read the group's tabs in one batchGet and write them to their tables in parallel
+        Tabs that had at least a block of rows last pass are streamed in row
+        blocks instead, so memory stays bounded and fetch overlaps the writes
+        """
+        sheet_id = configs[0].sheet_id
+        group_key = f"sheet:{sheet_id}"
+        marker = None
+        if not force and getattr(self.sheets.change_probe, "spreadsheet_wide", False):
+            # The probe covers all tabs, so one probe decides for the whole group
+            marker, unchanged = await self._probe_sheet(group_key, sheet_id, configs[0].sheet_name)
+            if unchanged:
+                logger.info(f"Sheet→DB: spreadsheet {sheet_id} unchanged since last pass, skipping read")
+                return False
+        
+        # strict_columns tabs only read their mapped columns, located from their header rows
+        strict = [config for config in configs if config.strict_columns]
+        if strict:
+            rows = await self.sheets.batch_get(sheet_id, [f"{config.sheet_name}!1:1" for config in strict])
+            for config, values in zip(strict, rows):
+                header_rows[config.id] = values[0] if values else []
+        
+        large = [config for config in configs if self.tab_rows_read.get(config.id, 0) >= SHEETS_READ_BLOCK_ROWS]
+        batched = [config for config in configs if config not in large]
+        
+        ranges, tab_runs = [], []
+        for config in batched:
+            runs = self._projection(config, header_rows[config.id]) if config.strict_columns else None
+            tab_runs.append(runs)
+            if runs is None:
+                ranges.append(f"{config.sheet_name}!A:Z")
+            else:
+                ranges.extend(
+                    f"{config.sheet_name}!{column_letter(first)}:{column_letter(last)}" for first, last in runs
+                )
+        
+        values = iter(await self.sheets.batch_get(sheet_id, ranges) if ranges else [])
+        tabs = []
+        for runs in tab_runs:
+            if runs is None:
+                tabs.append(next(values))
+            else:
+                tabs.append(stitch_columns([next(values) for _ in runs], runs))
+        
+        results = await asyncio.gather(
+            *(self._sync_sheet_to_db(config, rows=rows) for config, rows in zip(batched, tabs)),
+            *(self._sync_sheet_to_db(config, force=True, header_row=header_rows.get(config.id)) for config in large),
+            return_exceptions=True
+        )
+        errors = [result for result in results if isinstance(result, Exception)]
+        if errors:
+            # The other tabs are written; the failed ones are retried next pass
+            raise errors[0]
+        self.probe_markers[group_key] = marker
+        return any(results)
+    
+    async def _group_db_to_sheet(self, configs: list, header_rows: dict):
+        """Write every changed table back to its tab in one batchUpdate"""
+        sheet_id = configs[0].sheet_id
+        
+        async def plan(config):
+            with self._track_pass(config, "db_to_sheet"):
+                return config, await self._plan_sheet_update(config, header_rows.get(config.id))
+        
+        updates = [(config, update) for config, update in await asyncio.gather(*(plan(c) for c in configs)) if update]
+        if not updates:
+            return False
+        
+        data, clear_ranges = {}, []
+        for _, update in updates:
+            data.update(update["data"])
+            clear_ranges.extend(update["clear_ranges"])
+        await self._write_sheet_update(sheet_id, data, clear_ranges)
+        for config, update in updates:
+            self._sheet_update_written(config, update)
+        return True
+    
+    def _delta_rows(self, config, deltas: list):
+        """
+        Turn Apps Script delta blocks into partial rows keyed by sheet_row_id
+        Returns (rows, needs_resync); a touched header row means the structure
+        may have changed, and a row whose edited cells were all cleared may now
+        be empty (a full pass deletes those), so neither can be applied on its own
+        """
+        rows = {}
+        mapping = config.column_mapping or {}
+        for delta in deltas:
+            if delta["row"] <= 1:
+                return [], True
+            columns = [
+                None if config.strict_columns and str(header).strip() not in mapping else self._db_column(config, header)
+                for header in delta["headers"]
+            ]
+            for i, values in enumerate(delta["values"]):
+                sheet_row_id = delta["row"] + i
+                row = rows.setdefault(sheet_row_id, {'sheet_row_id': sheet_row_id})
+                for column, value in zip(columns, values):
+                    if column is not None:
+                        row[column] = "" if value is None else str(value).strip()
+        rows = [row for row in rows.values() if len(row) > 1]
+        if any(not any(value for column, value in row.items() if column != 'sheet_row_id') for row in rows):
+            return [], True
+        return rows, False
+    
+    async def apply_deltas(self, config, seq: int, deltas: list):
+        """
+        Apply an Apps Script delta batch straight to MySQL, without reading the sheet
+        deltas are {"row", "column", "headers", "values"} blocks (1-based top-left
+        cell, the header of each block column and a 2D block of display values).
+        seq must follow the last applied batch; the sequence check and the upserts
+        commit in one transaction. Only a replay of a recently applied batch is a
+        duplicate; any other unexpected seq (a gap, or a counter that went back)
+        or a delta we cannot apply on its own (header edits, unknown columns, row
+        filters) falls back to re-reading the tab, and the sequence continues
+        from this batch. Returns {"status": "applied" | "duplicate" | "resynced", "rows": n}
+        """
+        from app.database import AsyncSessionLocal
+        
+        with metrics.config_scope(config.id), \
+                tracer.span("sync.delta", config_id=config.id, seq=seq, blocks=len(deltas)) as span:
+            fingerprint = self._fingerprint(deltas)
+            recent = self.recent_deltas.setdefault(config.id, OrderedDict())
+            rows, needs_resync = self._delta_rows(config, deltas)
+            if not needs_resync:
+                known = {column.lower() for column in await self.mysql.get_columns(config.table_name)}
+                # The filter needs whole rows, and new headers need schema changes first
+                needs_resync = bool(config.row_filter) or any(
+                    column.lower() not in known for row in rows for column in row
+                )
             
-            # Get sheet data with retry logic
-            max_retries = 3
-            sheet_data = None
+            status, written = "resynced", 0
+            if not needs_resync:
+                async with AsyncSessionLocal() as db:
+                    result = await db.execute(
+                        update(SyncConfig)
+                        .where(SyncConfig.id == config.id,
+                               or_(SyncConfig.delta_seq.is_(None), SyncConfig.delta_seq == seq - 1))
+                        .values(delta_seq=seq)
+                    )
+                    if result.rowcount:
+                        written = await self.mysql.upsert_data_with_sheet_row_id(
+                            config.table_name, rows, conn=await db.connection()
+                        )
+                        status = "applied"
+                    elif recent.get(seq) == fingerprint:
+                        status = "duplicate"
+                    else:
+                        current = (await db.execute(
+                            select(SyncConfig.delta_seq).where(SyncConfig.id == config.id)
+                        )).scalar()
+                        logger.info(f"Delta sequence gap for {config.id}: expected {(current or 0) + 1}, got {seq}")
+                    await db.commit()
             
-            for attempt in range(max_retries):
-                try:
-                    sheet_data = await self.sheets.get_data(config.sheet_id, f"{config.sheet_name}!A:Z")
-                    break
-                except Exception as e:
-                    logger.warning(f"Sheet access attempt {attempt + 1} failed: {e}")
-                    if attempt == max_retries - 1:
-                        raise
-                    await asyncio.sleep(2)
+            if status == "resynced":
+                # Re-read the tab, then continue the sequence from this batch, even
+                # if that lowers it (the Apps Script's counter was reset)
+                resynced = await self.sync_config(config, directions=("sheet_to_db",), force=True, lane="interactive")
+                if resynced is None:
+                    # The edit is not in the table yet; keep the sequence so the retry resyncs again
+                    raise SyncBusy(f"Sync for {config.id} is busy, retry later")
+                async with AsyncSessionLocal() as db:
+                    await db.execute(update(SyncConfig).where(SyncConfig.id == config.id).values(delta_seq=seq))
+                    await db.commit()
             
-            if not sheet_data or len(sheet_data) <= 1:
-                logger.info("No data rows found in sheet")
-                return
-            
-            headers = sheet_data[0]
-            rows = sheet_data[1:]
+            if status != "duplicate":
+                recent[seq] = fingerprint
+                recent.move_to_end(seq)
+                while len(recent) > RECENT_DELTA_BATCHES:
+                    recent.popitem(last=False)
             
-            # Convert sheet data to database format with sheet_row_id
+            span.set_attribute("status", status)
+            metrics.delta_batches.inc(config=config.id, outcome=status)
+            if status == "applied":
+                metrics.rows_written.inc(written, config=config.id, direction="delta")
+                event_bus.publish("rows_changed", config_id=config.id, direction="delta", rows=written, seq=seq)
+            return {"status": status, "rows": written}
+    
+    def loop_health(self, stale_after: float):
+        """Liveness of each running sync loop, based on its last successful pass"""
+        now = time.time()
+        loops = []
+        for config_id, task in self.tasks.items():
+            last_success = self.loop_last_success.get(config_id)
+            reference = last_success or self.loop_started.get(config_id, now)
+            # An idle config may legitimately sleep for its whole backed-off interval
+            schedule = self.schedules.get(config_id)
+            allowed = stale_after + (schedule.interval if schedule else 0)
+            loops.append({
+                "config_id": config_id,
+                "running": not task.done(),
+                "last_success": datetime.fromtimestamp(last_success).isoformat() if last_success else None,
+                "seconds_since_success": round(now - last_success, 1) if last_success else None,
+                "poll_interval": schedule.interval if schedule else None,
+                "healthy": not task.done() and now - reference <= allowed
+            })
+        return loops
+    
+    @contextmanager
+    def _track_pass(self, config, direction: str):
+        """Record duration, errors and last success of one sync pass, and publish its start and end"""
+        with metrics.config_scope(config.id), tracer.span(f"sync.{direction}", config_id=config.id, table=config.table_name):
+            event_bus.publish("pass_started", config_id=config.id, direction=direction)
+            start = time.perf_counter()
+            try:
+                yield
+            except Exception as e:
+                metrics.sync_pass_errors.inc(config=config.id, direction=direction)
+                event_bus.publish("pass_failed", config_id=config.id, direction=direction, error=str(e),
+                                  duration=round(time.perf_counter() - start, 3))
+                raise
+            finally:
+                metrics.sync_pass_duration.observe(time.perf_counter() - start, config=config.id, direction=direction)
+            metrics.sync_last_success.set(time.time(), config=config.id, direction=direction)
+            event_bus.publish("pass_finished", config_id=config.id, direction=direction,
+                              duration=round(time.perf_counter() - start, 3))
+    
+    @staticmethod
+    def _db_column(config, header: str):
+        """Table column a sheet header maps to, or None for blank and display-only headers"""
+        header = str(header).strip()
+        if not header or header.lower().replace(' ', '_') == 'sheet_row_id':
+            return None
+        return config.column_mapping.get(header, header.lower().replace(' ', '_'))
+    
+    async def _reconcile_headers(self, config, headers: list):
+        """
+        Bring the table in line with the sheet's header row before writing
+        Checked against the cached schema, so an unchanged header row costs no
+        query. A header that replaced the one at the same position (which is
+        gone) is a rename and gets mapped onto the old column; other new headers
+        get new columns, and header columns this service created whose header
+        disappeared are deprecated
+        """
+        columns = {column.lower(): column for column in await self.mysql.get_columns(config.table_name)}
+        deprecated = {column.lower() for column in await self.mysql.get_deprecated_columns(config.table_name)}
+        previous = self.sheet_headers.get(config.id, [])
+        mapping = dict(config.column_mapping or {})
+        claimed = self._claimed_columns(config, headers)
+        unknown = []
+        
+        for i, header in enumerate(headers):
+            db_column = self._db_column(config, header)
+            if db_column is None or db_column.lower() in columns:
+                continue
+            old_header = previous[i] if i < len(previous) else None
+            old_column = self._db_column(config, old_header) if old_header is not None else None
+            if (SYNC_SCHEMA_EVOLUTION and old_column and old_column.lower() in columns
+                    and old_column.lower() not in claimed):
+                mapping[str(header).strip()] = columns[old_column.lower()]
+                claimed.add(old_column.lower())
+                logger.info(f"Header '{old_header}' renamed to '{header}', keeping column {old_column}")
+                metrics.schema_changes.inc(config=config.id, change="renamed")
+            else:
+                unknown.append(header)
+        
+        if unknown and not SYNC_SCHEMA_EVOLUTION:
+            raise SchemaMismatch(f"Sheet headers {unknown} have no matching column in {config.table_name}")
+        if mapping != (config.column_mapping or {}):
+            await self._save_column_mapping(config, mapping)
+        
+        for header in unknown:
+            column = self._db_column(config, header)
+            await self.mysql.add_column(config.table_name, column)
+            logger.info(f"Added column {column} to {config.table_name} for new header '{header}'")
+            metrics.schema_changes.inc(config=config.id, change="added")
+        
+        if SYNC_SCHEMA_EVOLUTION and claimed:
+            for column in await self.mysql.get_managed_columns(config.table_name):
+                key = column.lower()
+                if key in INTERNAL_COLUMNS:
+                    continue
+                if key not in claimed and key not in deprecated:
+                    # Keep the data, just stop writing the column back to the sheet
+                    await self.mysql.set_column_deprecated(config.table_name, column, True)
+                    logger.info(f"Header for {column} removed from sheet, deprecated the column")
+                    metrics.schema_changes.inc(config=config.id, change="deprecated")
+                elif key in claimed and key in deprecated:
+                    await self.mysql.set_column_deprecated(config.table_name, column, False)
+                    logger.info(f"Header for {column} is back in the sheet, restored the column")
+                    metrics.schema_changes.inc(config=config.id, change="restored")
+        
+        self.sheet_headers[config.id] = list(headers)
+    
+    def _claimed_columns(self, config, headers: list):
+        """Lowercased columns the header row maps to, with the _1, _2... names create_table gives repeated headers"""
+        claimed = set()
+        for header in headers:
+            column = self._db_column(config, header)
+            if not column:
+                continue
+            key, counter = column.lower(), 1
+            while key in claimed:
+                key = f"{column.lower()}_{counter}"
+                counter += 1
+            claimed.add(key)
+        return claimed
+    
+    async def _save_column_mapping(self, config, mapping: dict):
+        """Persist a column mapping learned from a header rename"""
+        from app.database import AsyncSessionLocal
+        
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(SyncConfig).where(SyncConfig.id == config.id).values(column_mapping=mapping))
+            await db.commit()
+        config.column_mapping = mapping
+    
+    def _transform_sheet_rows(self, config, headers: list, rows: list, first_row: int):
+        """Convert sheet rows to database format with sheet_row_id; first_row is the sheet row number of rows[0]"""
+        with tracer.span("sync.transform", rows=len(rows)) as span:
             data_with_row_ids = []
-            active_sheet_row_ids = []
+            row_filter = RowFilter(config.row_filter)
+            filtered = 0
             
             for i, row in enumerate(rows):
+                sheet_row_id = first_row + i
                 try:
-                    # Sheet row index starts from 2 (row 1 is header, row 2 is first data)
-                    sheet_row_id = i + 2
-                    
                     row_dict = {'sheet_row_id': sheet_row_id}
                     has_data = False
                     
                     for j, header in enumerate(headers):
                         # Skip the "Sheet Row Id" column - it's for display only
-                        if header.lower().replace(' ', '_') == 'sheet_row_id':
+                        db_column = self._db_column(config, header)
+                        if db_column is None:
                             continue
-                            
-                        db_column = config.column_mapping.get(header, header.lower().replace(' ', '_'))
+                        
                         value = row[j] if j < len(row) else ""
                         
                         # Clean and validate value
@@ -138,44 +724,176 @@ class SyncService:
                         if value:  # Check if row has any data
                             has_data = True
                     
-                    # Only include rows with actual data
-                    if has_data:
+                    # Only include rows with actual data that pass the config's row filter
+                    if has_data and row_filter and not row_filter.matches(row_dict):
+                        filtered += 1
+                    elif has_data:
                         data_with_row_ids.append(row_dict)
-                        active_sheet_row_ids.append(sheet_row_id)
-                        
+                    
                 except Exception as e:
-                    logger.warning(f"Skipping row {i + 2} due to error: {e}")
+                    logger.warning(f"Skipping row {sheet_row_id} due to error: {e}")
                     continue
             
-            if data_with_row_ids:
-                # Professional UPSERT using sheet_row_id
-                await self.mysql.upsert_data_with_sheet_row_id(config.table_name, data_with_row_ids)
-                logger.info(f"Sheet→DB: Synced {len(data_with_row_ids)} rows to {config.table_name}")
+            span.set_attribute("valid_rows", len(data_with_row_ids))
+            if row_filter:
+                span.set_attribute("filtered_rows", filtered)
+            return data_with_row_ids
+    
+    def _projection(self, config, header_row: list):
+        """Column index runs holding the mapped headers, for strict_columns configs"""
+        mapping = config.column_mapping or {}
+        return contiguous_runs(i for i, header in enumerate(header_row) if str(header).strip() in mapping)
+    
+    async def _read_header_row(self, config):
+        values = await self.sheets.get_data(config.sheet_id, f"{config.sheet_name}!1:1")
+        return values[0] if values else []
+    
+    async def _row_blocks(self, config, header_row: list = None):
+        """The tab's row blocks; strict_columns configs only fetch the mapped columns"""
+        if not config.strict_columns:
+            return self.sheets.iter_row_blocks(config.sheet_id, config.sheet_name)
+        if header_row is None:
+            header_row = await self._read_header_row(config)
+        runs = self._projection(config, header_row)
+        if not runs:
+            raise ValueError(f"None of the mapped headers were found in {config.sheet_name}")
+        return self.sheets.iter_row_blocks(config.sheet_id, config.sheet_name, runs=runs)
+    
+    def _record_pipeline_stats(self, config, stage_stats: dict):
+        """Export how long each pipeline stage spent working versus waiting"""
+        for stage, stats in stage_stats.items():
+            metrics.pipeline_stage_seconds.inc(stats["busy_seconds"], config=config.id, stage=stage, state="busy")
+            metrics.pipeline_stage_seconds.inc(stats["stalled_seconds"], config=config.id, stage=stage, state="stalled")
+        summary = ", ".join(
+            f"{stage} busy {stats['busy_seconds']:.2f}s/stalled {stats['stalled_seconds']:.2f}s"
+            for stage, stats in stage_stats.items()
+        )
+        logger.info(f"Sheet→DB pipeline for {config.table_name}: {summary}")
+    
+    async def _sync_sheet_to_db(self, config, force: bool = False, rows: list = None, header_row: list = None):
+        """
+        Sync Google Sheet → Database with sheet_row_id mapping (NO MORE DUPLICATES)
+        force skips the change probe, for webhook and manual triggers that know the sheet changed.
+        rows are the tab's values when the caller already read them (sync groups);
+        the probe is then left to the caller. header_row spares strict_columns
+        configs a header read when the caller already has it
+        """
+        with self._track_pass(config, "sheet_to_db"):
+            try:
+                logger.info(f"Starting Sheet→DB sync for {config.table_name}")
+            
+                # Skip the full read when the probe shows the sheet is unchanged
+                marker, unchanged = (None, False) if force or rows is not None else await self._probe_sheet(
+                    config.id, config.sheet_id, config.sheet_name
+                )
+                if unchanged:
+                    logger.info(f"Sheet→DB: {config.sheet_name} unchanged since last pass, skipping read")
+                    return False
                 
-                # Optional: Clean up deleted rows (rows removed from sheet)
-                await self.mysql.cleanup_deleted_sheet_rows(config.table_name, active_sheet_row_ids)
-                logger.info(f"Sheet→DB: Cleaned up deleted rows")
-            else:
-                logger.info("No valid data to sync to database")
+                # Stream the sheet in row blocks (quota and retries are handled by
+                # SheetsService) through fetch → transform → write → cleanup stages,
+                # so block N is written while block N+1 is still downloading
+                headers = None
+                digest = hashlib.blake2b(digest_size=16)
+                active_sheet_row_ids = []
+                rows_read = 0
+                written = 0
+                deleted = 0
                 
-        except Exception as e:
-            logger.error(f"Sheet→DB sync error: {e}")
-            raise
+                async def transform(item):
+                    nonlocal headers, rows_read
+                    first_row, block = item
+                    digest.update(json.dumps(block).encode())
+                    if headers is None:
+                        headers = block[0] if block else []
+                        block, first_row = block[1:], first_row + 1
+                        await self._reconcile_headers(config, headers)
+                    rows_read += len(block)
+                    return self._transform_sheet_rows(config, headers, block, first_row) or None
+                
+                async def write(data_with_row_ids):
+                    nonlocal written
+                    # Professional UPSERT using sheet_row_id
+                    written += await self.mysql.upsert_data_with_sheet_row_id(config.table_name, data_with_row_ids)
+                    return [row['sheet_row_id'] for row in data_with_row_ids]
+                
+                async def collect_row_ids(row_ids):
+                    active_sheet_row_ids.extend(row_ids)
+                
+                async def cleanup():
+                    nonlocal deleted
+                    # Clean up deleted rows (rows removed from sheet) once every block is in
+                    if active_sheet_row_ids:
+                        deleted = await self.mysql.cleanup_deleted_sheet_rows(config.table_name, active_sheet_row_ids)
+                
+                pipeline = (
+                    Pipeline()
+                    .source("fetch", await self._row_blocks(config, header_row) if rows is None else _single_block(rows))
+                    .stage("transform", transform)
+                    .stage("write", write)
+                    .stage("cleanup", collect_row_ids, on_finish=cleanup)
+                )
+                stage_stats = await pipeline.run()
+                self._record_pipeline_stats(config, stage_stats)
+                
+                changed = self._fingerprint_changed(config.id, "sheet_to_db", digest.hexdigest())
+                metrics.rows_read.inc(rows_read, config=config.id, direction="sheet_to_db")
+                # Decides whether a group pass reads this tab whole or in blocks next time
+                self.tab_rows_read[config.id] = rows_read
+                metrics.rows_written.inc(written, config=config.id, direction="sheet_to_db")
+                metrics.rows_deleted.inc(deleted, config=config.id)
+                if changed:
+                    event_bus.publish("rows_changed", config_id=config.id, direction="sheet_to_db",
+                                      rows=written, deleted=deleted)
+                
+                if not rows_read:
+                    logger.info("No data rows found in sheet")
+                elif active_sheet_row_ids:
+                    logger.info(f"Sheet→DB: Synced {len(active_sheet_row_ids)} rows to {config.table_name}")
+                    logger.info(f"Sheet→DB: Cleaned up {deleted} deleted rows")
+                else:
+                    logger.info("No valid data to sync to database")
+                
+                # Only remember the marker once the data is safely in the DB
+                if rows is None:
+                    self.probe_markers[config.id] = marker
+                return changed
+                
+            except Exception as e:
+                logger.error(f"Sheet→DB sync error: {e}")
+                raise
     
-    async def _sync_db_to_sheet(self, config):
-        """Sync Database → Google Sheet (excludes internal id and sheet_row_id)"""
-        try:
-            logger.info(f"Starting DB→Sheet sync for {config.table_name}")
-            
-            # Get database data
-            db_data = await self.mysql.get_all_data(config.table_name)
-            
-            if not db_data:
-                logger.info("No data found in database")
-                return
-            
-            # Convert to sheet format (exclude internal columns)
-            headers = [col for col in db_data[0].keys() if col not in ['id', 'sheet_row_id']]
+    async def _plan_sheet_update(self, config, header_row: list = None):
+        """
+        Build the DB→Sheet write for a config without sending it
+        Returns None when the table is unchanged since the last write, otherwise
+        a dict with the ranges to write, the ranges to clear below them, and
+        what to record once the write went through. Each column is written back
+        to where its header sits in header_row (the last header row seen, or
+        read here if unknown); strict_columns configs only write mapped columns
+        """
+        # Get database data; the row filter is evaluated by MySQL
+        where, params = RowFilter(config.row_filter).where_clause()
+        db_data = await self.mysql.get_all_data(config.table_name, where, params)
+        metrics.rows_read.inc(len(db_data), config=config.id, direction="db_to_sheet")
+        
+        fingerprint = self._fingerprint(db_data)
+        if self.fingerprints.get((config.id, "db_to_sheet")) == fingerprint:
+            # Rewriting identical values would only bump the sheet's
+            # version and defeat the change probe
+            logger.info("DB→Sheet: table unchanged since last write, skipping sheet update")
+            return None
+        
+        with tracer.span("sync.transform", rows=len(db_data)):
+            # Column plan comes from the cached table schema, so an
+            # emptied table still produces the header row
+            headers = [
+                col for col in await self.mysql.get_columns(config.table_name, include_deprecated=False)
+                if col not in INTERNAL_COLUMNS
+            ]
+            if config.strict_columns:
+                mapped_columns = set(config.column_mapping.values())
+                headers = [col for col in headers if col in mapped_columns]
             
             # Create reverse mapping (db_column → sheet_column)
             reverse_mapping = {v: k for k, v in config.column_mapping.items()}
@@ -188,6 +906,13 @@ class SyncService:
             
             # Convert data rows
             sheet_rows = [sheet_headers]  # Start with headers
+            if where:
+                # Filtered tables only hold some of the sheet's rows, so each row
+                # goes back to its own sheet row instead of being packed from the top
+                db_data = sorted(db_data, key=lambda row: row['sheet_row_id'])
+                row_numbers = [1] + [row['sheet_row_id'] for row in db_data]
+            else:
+                row_numbers = list(range(1, len(db_data) + 2))
             
             for row in db_data:
                 sheet_row = []
@@ -198,22 +923,99 @@ class SyncService:
                         value = ''
                     sheet_row.append(str(value))
                 sheet_rows.append(sheet_row)
-            
-            # Update Google Sheet with retry logic
-            max_retries = 3
-            for attempt in range(max_retries):
-                try:
-                    await self.sheets.update_data(config.sheet_id, f"{config.sheet_name}!A:Z", sheet_rows)
-                    logger.info(f"DB→Sheet: Synced {len(db_data)} rows to Google Sheet")
-                    break
-                except Exception as e:
-                    logger.warning(f"Sheet update attempt {attempt + 1} failed: {e}")
-                    if attempt == max_retries - 1:
-                        raise
-                    await asyncio.sleep(2)
+        
+        # values.update leaves rows below the new data alone; clear them when the table
+        # shrank (filtered tables never clear, rows outside the filter are not ours)
+        row_count = len(sheet_rows)
+        previous_rows = self.sheet_row_counts.get(config.id)
+        shrank = not where and (not db_data or (previous_rows and previous_rows > row_count))
+        
+        if config.strict_columns:
+            if header_row is None:
+                header_row = await self._read_header_row(config)
+            positions = {str(header).strip(): i for i, header in enumerate(header_row)}
+            missing = [header for header in sheet_headers if header not in positions]
+            if missing:
+                logger.warning(f"DB→Sheet: mapped headers {missing} not found in {config.sheet_name}, not written")
+            placed = {positions[header]: j for j, header in enumerate(sheet_headers) if header in positions}
+        else:
+            # Each column goes back under its own header; add_column appends new
+            # columns at the end of the table, which need not match the sheet order
+            if header_row is None:
+                header_row = self.sheet_headers.get(config.id)
+            if header_row is None:
+                header_row = await self._read_header_row(config)
+            positions = {}
+            for i, header in enumerate(header_row):
+                column = self._db_column(config, header)
+                if column is not None:
+                    positions.setdefault(column.lower(), i)
+            placed, next_free = {}, len(header_row)
+            for j, column in enumerate(headers):
+                position = positions.get(column.lower())
+                if position is None:
+                    # Not in the sheet yet: append after its last header
+                    position, next_free = next_free, next_free + 1
+                else:
+                    sheet_headers[j] = str(header_row[position]).strip()
+                placed[position] = j
+        
+        # One range per block of adjacent columns and adjacent sheet rows
+        rows_by_number = dict(zip(row_numbers, sheet_rows))
+        data, clear_ranges = {}, []
+        for first, last in contiguous_runs(placed):
+            columns = [placed[i] for i in range(first, last + 1)]
+            for first_row, last_row in contiguous_runs(row_numbers):
+                data[f"{config.sheet_name}!{column_letter(first)}{first_row}:{column_letter(last)}{last_row}"] = [
+                    [rows_by_number[number][j] for j in columns] for number in range(first_row, last_row + 1)
+                ]
+            if shrank:
+                clear_ranges.append(f"{config.sheet_name}!{column_letter(first)}{row_count + 1}:{column_letter(last)}")
+        
+        return {
+            "data": data,
+            "clear_ranges": clear_ranges,
+            "rows": row_count,
+            "fingerprint": fingerprint,
+            "db_rows": len(db_data),
+        }
+    
+    async def _write_sheet_update(self, sheet_id: str, data: dict, clear_ranges: list):
+        """Send planned writes, batching them when there is more than one range"""
+        if len(data) == 1:
+            [(range_name, values)] = data.items()
+            await self.sheets.update_data(sheet_id, range_name, values)
+        elif data:
+            await self.sheets.batch_update(sheet_id, data)
+        if len(clear_ranges) == 1:
+            await self.sheets.clear_data(sheet_id, clear_ranges[0])
+        elif clear_ranges:
+            await self.sheets.batch_clear(sheet_id, clear_ranges)
+    
+    def _sheet_update_written(self, config, update: dict):
+        """Record a DB→Sheet write once the Sheets API accepted it"""
+        self.sheet_row_counts[config.id] = update["rows"]
+        self.fingerprints[(config.id, "db_to_sheet")] = update["fingerprint"]
+        metrics.rows_written.inc(update["db_rows"], config=config.id, direction="db_to_sheet")
+        event_bus.publish("rows_changed", config_id=config.id, direction="db_to_sheet", rows=update["db_rows"])
+        logger.info(f"DB→Sheet: Synced {update['db_rows']} rows to Google Sheet")
+    
+    async def _sync_db_to_sheet(self, config):
+        """Sync Database → Google Sheet (excludes internal id and sheet_row_id)"""
+        with self._track_pass(config, "db_to_sheet"):
+            try:
+                logger.info(f"Starting DB→Sheet sync for {config.table_name}")
+                update = await self._plan_sheet_update(config)
+                if update is None:
+                    return False
+                
+                # Update Google Sheet (quota and retries are handled by SheetsService)
+                await self._write_sheet_update(config.sheet_id, update["data"], update["clear_ranges"])
+                self._sheet_update_written(config, update)
+                return True
                     
-        except Exception as e:
-            logger.error(f"DB→Sheet sync error: {e}")
-            raise
+            except Exception as e:
+                logger.error(f"DB→Sheet sync error: {e}")
+                raise
 
 sync_service = SyncService()
\ No newline at end of file
@@ -0,0 +1,183 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import urllib.request
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from app.config import TRACING_ENABLED, TRACE_BUFFER_SIZE, OTLP_ENDPOINT, OTLP_SERVICE_NAME
+
+logger = logging.getLogger(__name__)
+
+current_span = ContextVar("current_span", default=None)
+
+
+class Span:
+    recording = True
+
+    def __init__(self, name: str, parent=None, attributes=None):
+        self.name = name
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.attributes = dict(attributes or {})
+        self.error = None
+        self.start_ns = time.time_ns()
+        self._start = time.perf_counter()
+        self.duration = None
+        self.children = []
+        # Every span of a trace is collected on its root so the trace can be
+        # exported as a unit once the root finishes
+        self.trace_spans = parent.trace_spans if parent else []
+        self.trace_spans.append(self)
+        if parent:
+            parent.children.append(self)
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def end(self):
+        self.duration = time.perf_counter() - self._start
+
+    @property
+    def end_ns(self):
+        return self.start_ns + int((self.duration or 0) * 1e9)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "start": self.start_ns / 1e9,
+            "duration_ms": round((self.duration or 0) * 1000, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+            "children": [child.to_dict() for child in self.children]
+        }
+
+
+class _NoopSpan:
+    recording = False
+
+    def set_attribute(self, key: str, value):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class OTLPExporter:
+    """Ships finished traces to an OTLP/HTTP collector from a background thread"""
+
+    def __init__(self, endpoint: str, service_name: str, max_queue: int = 100):
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.service_name = service_name
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, name="otlp-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, spans: list):
+        try:
+            self._queue.put_nowait(spans)
+        except queue.Full:
+            logger.warning("OTLP export queue full, dropping trace")
+
+    def _run(self):
+        while True:
+            spans = self._queue.get()
+            try:
+                self._post(self._payload(spans))
+            except Exception as e:
+                logger.warning(f"OTLP export failed: {e}")
+
+    def _post(self, payload: dict):
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(payload).encode(),
+            headers={"Content-Type": "application/json"},
+            method="POST"
+        )
+        with urllib.request.urlopen(request, timeout=5) as response:
+            response.read()
+
+    @staticmethod
+    def _attribute(key, value):
+        if isinstance(value, bool):
+            return {"key": key, "value": {"boolValue": value}}
+        if isinstance(value, int):
+            return {"key": key, "value": {"intValue": str(value)}}
+        if isinstance(value, float):
+            return {"key": key, "value": {"doubleValue": value}}
+        return {"key": key, "value": {"stringValue": str(value)}}
+
+    def _payload(self, spans: list):
+        otlp_spans = []
+        for span in spans:
+            otlp_span = {
+                "traceId": span.trace_id,
+                "spanId": span.span_id,
+                "name": span.name,
+                "kind": 1,
+                "startTimeUnixNano": str(span.start_ns),
+                "endTimeUnixNano": str(span.end_ns),
+                "attributes": [self._attribute(k, v) for k, v in span.attributes.items()],
+                "status": {"code": 2, "message": span.error} if span.error else {"code": 1}
+            }
+            if span.parent:
+                otlp_span["parentSpanId"] = span.parent.span_id
+            otlp_spans.append(otlp_span)
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [self._attribute("service.name", self.service_name)]},
+                "scopeSpans": [{"scope": {"name": "superjoin-sync"}, "spans": otlp_spans}]
+            }]
+        }
+
+
+class Tracer:
+    def __init__(self, enabled: bool, buffer_size: int, exporter=None):
+        self.enabled = enabled
+        self.exporter = exporter
+        self.traces = deque(maxlen=buffer_size)
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """Record a span nested under the span currently active in this task"""
+        if not self.enabled:
+            yield NOOP_SPAN
+            return
+        parent = current_span.get()
+        span = Span(name, parent, attributes)
+        token = current_span.set(span)
+        try:
+            yield span
+        except Exception as e:
+            span.error = str(e)
+            raise
+        finally:
+            span.end()
+            current_span.reset(token)
+            if parent is None:
+                self._finish_trace(span)
+
+    def _finish_trace(self, root: Span):
+        self.traces.append(root)
+        if self.exporter:
+            self.exporter.export(root.trace_spans)
+
+    def recent(self, limit: int = 20):
+        """Most recent finished traces, newest first"""
+        traces = list(self.traces)[-limit:]
+        return [
+            {"trace_id": root.trace_id, **root.to_dict()}
+            for root in reversed(traces)
+        ]
+
+
+tracer = Tracer(
+    TRACING_ENABLED,
+    TRACE_BUFFER_SIZE,
+    OTLPExporter(OTLP_ENDPOINT, OTLP_SERVICE_NAME) if TRACING_ENABLED and OTLP_ENDPOINT else None
+)
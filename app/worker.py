@@ -0,0 +1,217 @@
+"""
+Sharded sync worker
+
+Run one or more worker processes per host with SYNC_MODE=external on the API:
+
+    python -m app.worker --processes 4
+
+Every worker heartbeats into `sync_workers`. Active configs are spread over
+the live workers with a consistent hash ring, and a worker only runs a
+config's loop while it holds that config's lease in `sync_leases`, so exactly
+one worker syncs a config even while the ring is changing. Configs are placed
+by spreadsheet, so every tab of a sync group runs on the same worker.
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import asyncio
+import bisect
+import hashlib
+import logging
+import multiprocessing
+import signal
+import socket
+import uuid
+from sqlalchemy import select, text
+
+from app.config import WORKER_HEARTBEAT_SECONDS, WORKER_LEASE_SECONDS
+from app.database import engine, init_db, AsyncSessionLocal
+from app.models import SyncConfig
+
+logger = logging.getLogger(__name__)
+
+
+def _hash(key: str) -> int:
+    return int(hashlib.md5(key.encode()).hexdigest()[:16], 16)
+
+
+class HashRing:
+    """Consistent hash ring with virtual nodes, so a worker joining or leaving only moves its share of configs"""
+
+    def __init__(self, nodes, replicas: int = 64):
+        self._ring = sorted(
+            (_hash(f"{node}#{replica}"), node)
+            for node in nodes
+            for replica in range(replicas)
+        )
+        self._points = [point for point, _ in self._ring]
+
+    def owner(self, key: str):
+        if not self._ring:
+            return None
+        index = bisect.bisect(self._points, _hash(key)) % len(self._ring)
+        return self._ring[index][1]
+
+
+class LeaseStore:
+    """Worker heartbeats and per-config leases kept in MySQL"""
+
+    def __init__(self, worker_id: str):
+        self.worker_id = worker_id
+
+    async def heartbeat(self):
+        async with engine.begin() as conn:
+            await conn.execute(text("""
+                INSERT INTO sync_workers (worker_id, hostname, pid, heartbeat_at)
+                VALUES (:worker_id, :hostname, :pid, UTC_TIMESTAMP())
+                ON DUPLICATE KEY UPDATE heartbeat_at = VALUES(heartbeat_at)
+            """), {"worker_id": self.worker_id, "hostname": socket.gethostname(), "pid": os.getpid()})
+
+    async def live_workers(self):
+        async with engine.begin() as conn:
+            result = await conn.execute(text("""
+                SELECT worker_id FROM sync_workers
+                WHERE heartbeat_at > UTC_TIMESTAMP() - INTERVAL :ttl SECOND
+            """), {"ttl": WORKER_LEASE_SECONDS})
+            return [row[0] for row in result.fetchall()]
+
+    async def acquire(self, config_id: str) -> bool:
+        """Take or renew the lease; succeeds only if it is free, expired or already ours"""
+        async with engine.begin() as conn:
+            # MySQL applies the assignments left to right, so expires_at is only
+            # extended when the owner column (re)names this worker
+            await conn.execute(text("""
+                INSERT INTO sync_leases (config_id, owner, expires_at)
+                VALUES (:config_id, :owner, UTC_TIMESTAMP() + INTERVAL :ttl SECOND)
+                ON DUPLICATE KEY UPDATE
+                    owner = IF(owner = VALUES(owner) OR expires_at < UTC_TIMESTAMP(), VALUES(owner), owner),
+                    expires_at = IF(owner = VALUES(owner), VALUES(expires_at), expires_at)
+            """), {"config_id": config_id, "owner": self.worker_id, "ttl": WORKER_LEASE_SECONDS})
+            result = await conn.execute(
+                text("SELECT owner FROM sync_leases WHERE config_id = :config_id"),
+                {"config_id": config_id}
+            )
+            return result.scalar() == self.worker_id
+
+    async def release(self, config_id: str):
+        async with engine.begin() as conn:
+            await conn.execute(
+                text("DELETE FROM sync_leases WHERE config_id = :config_id AND owner = :owner"),
+                {"config_id": config_id, "owner": self.worker_id}
+            )
+
+    async def retire(self):
+        """Drop this worker's heartbeat and leases so others can take over immediately"""
+        async with engine.begin() as conn:
+            await conn.execute(text("DELETE FROM sync_leases WHERE owner = :owner"), {"owner": self.worker_id})
+            await conn.execute(text("DELETE FROM sync_workers WHERE worker_id = :owner"), {"owner": self.worker_id})
+
+
+class ShardWorker:
+    def __init__(self):
+        # Imported here so each spawned process builds its own service and engine
+        from app.sync import sync_service
+        self.sync_service = sync_service
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.leases = LeaseStore(self.worker_id)
+        self.owned = set()
+        self._stopping = asyncio.Event()
+
+    async def _active_configs(self):
+        """(config_id, sheet_id) of every active config"""
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(select(SyncConfig.id, SyncConfig.sheet_id).where(SyncConfig.is_active == True))
+            return [(row[0], row[1]) for row in result.all()]
+
+    async def rebalance(self):
+        """Heartbeat, then start loops for configs we own on the ring and stop the rest"""
+        await self.leases.heartbeat()
+        ring = HashRing(await self.leases.live_workers() or [self.worker_id])
+        # Placed by spreadsheet, so all tabs of a sync group land on the same worker
+        wanted = {
+            config_id for config_id, sheet_id in await self._active_configs()
+            if ring.owner(sheet_id) == self.worker_id
+        }
+
+        for config_id in sorted(self.owned - wanted):
+            await self.sync_service.stop_loop(config_id)
+            await self.leases.release(config_id)
+            self.owned.discard(config_id)
+
+        for config_id in sorted(wanted):
+            if await self.leases.acquire(config_id):
+                if config_id not in self.owned:
+                    logger.info(f"Worker {self.worker_id} took over config {config_id}")
+                self.owned.add(config_id)
+                self.sync_service.start_loop(config_id)
+            elif config_id in self.owned:
+                # Someone else holds the lease (e.g. we stalled past its expiry)
+                await self.sync_service.stop_loop(config_id)
+                self.owned.discard(config_id)
+
+    async def _stop_all(self):
+        for config_id in list(self.owned):
+            await self.sync_service.stop_loop(config_id)
+        self.owned.clear()
+
+    async def run(self):
+        await init_db()
+        logger.info(f"Sync worker {self.worker_id} started")
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, self._stopping.set)
+
+        while not self._stopping.is_set():
+            try:
+                await self.rebalance()
+            except Exception as e:
+                # Without a working lease store we can no longer prove ownership
+                logger.error(f"Rebalance failed for {self.worker_id}, stopping owned loops: {e}")
+                await self._stop_all()
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=WORKER_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+        await self._stop_all()
+        try:
+            await self.leases.retire()
+        except Exception as e:
+            logger.warning(f"Failed to retire worker {self.worker_id}: {e}")
+        logger.info(f"Sync worker {self.worker_id} stopped")
+
+
+def _run_worker():
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(ShardWorker().run())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run sharded sync worker processes")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    if args.processes <= 1:
+        _run_worker()
+        return
+
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=_run_worker, name=f"sync-worker-{i}") for i in range(args.processes)]
+    for process in processes:
+        process.start()
+
+    def stop_children(signum, frame):
+        # Each worker shuts down gracefully on SIGTERM, releasing its leases
+        for process in processes:
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGINT, stop_children)
+    signal.signal(signal.SIGTERM, stop_children)
+    for process in processes:
+        process.join()
+
+if __name__ == "__main__":
+    main()
@@ -9,7 +9,7 @@ export default function AppsScriptIntegration({
   backendUrl,
 }: AppsScriptIntegrationProps) {
   const [connectionStatus, setConnectionStatus] = useState<
-    "testing" | "connected" | "disconnected" | "error"
+    "testing" | "connected" | "degraded" | "disconnected" | "error"
   >("disconnected");
   const [ngrokUrl, setNgrokUrl] = useState("");
   const [realtimeEvents, setRealtimeEvents] = useState<any[]>([]);
@@ -18,9 +18,16 @@ export default function AppsScriptIntegration({
   const testConnection = async () => {
     setConnectionStatus("testing");
     try {
-      const response = await axios.get(`${backendUrl}/health`);
-      if (response.status === 200 && response.data.apps_script_ready) {
+      // /health answers 503 when a sync loop is stale; the backend is still reachable then
+      const response = await axios.get(`${backendUrl}/health`, {
+        validateStatus: (status) => status === 200 || status === 503,
+      });
+      if (!response.data?.apps_script_ready) {
+        setConnectionStatus("error");
+      } else if (response.data.status === "healthy") {
         setConnectionStatus("connected");
+      } else if (response.data.status === "degraded") {
+        setConnectionStatus("degraded");
       } else {
         setConnectionStatus("error");
       }
@@ -112,7 +119,7 @@ const CONFIG = {
           className={`px-3 py-1 rounded-full text-sm font-medium ${
             connectionStatus === "connected"
               ? "bg-green-100 text-green-800"
-              : connectionStatus === "testing"
+              : connectionStatus === "testing" || connectionStatus === "degraded"
               ? "bg-yellow-100 text-yellow-800"
               : connectionStatus === "error"
               ? "bg-red-100 text-red-800"
@@ -120,6 +127,7 @@ const CONFIG = {
           }`}
         >
           {connectionStatus === "connected" && "✅ Connected"}
+          {connectionStatus === "degraded" && "⚠️ Connected, sync loops stale"}
           {connectionStatus === "testing" && "🔄 Testing..."}
           {connectionStatus === "error" && "❌ Error"}
           {connectionStatus === "disconnected" && "⏸️ Disconnected"}
@@ -1,3 +1,6 @@
+import { useState } from "react";
+import useSyncEvents, { SyncEvent } from "../hooks/useSyncEvents";
+
 interface SyncConfig {
   id: string;
   sheet_id: string;
@@ -11,13 +14,84 @@ interface SyncConfigListProps {
   configs: SyncConfig[];
   onConfigSelected: (config: SyncConfig) => void;
   onManualSync: () => void;
+  onConfigsChanged?: () => void;
+}
+
+interface LiveStatus {
+  syncing: number;
+  lastSync?: number;
+  error?: string;
 }
 
 export default function SyncConfigList({
   configs,
   onConfigSelected,
   onManualSync,
+  onConfigsChanged,
 }: SyncConfigListProps) {
+  const [liveStatus, setLiveStatus] = useState<Record<string, LiveStatus>>({});
+
+  const connected = useSyncEvents((event: SyncEvent) => {
+    if (event.type === "config_created" || event.type === "lagged") {
+      // The list itself changed, or we missed events: re-fetch once
+      onConfigsChanged?.();
+      return;
+    }
+    const id = event.config_id;
+    if (!id) return;
+    setLiveStatus((prev) => {
+      const current = prev[id] || { syncing: 0 };
+      switch (event.type) {
+        case "pass_started":
+          return {
+            ...prev,
+            [id]: { ...current, syncing: current.syncing + 1 },
+          };
+        case "pass_finished":
+          return {
+            ...prev,
+            [id]: {
+              syncing: Math.max(0, current.syncing - 1),
+              lastSync: event.time,
+            },
+          };
+        case "pass_failed":
+          return {
+            ...prev,
+            [id]: {
+              ...current,
+              syncing: Math.max(0, current.syncing - 1),
+              error: event.error,
+            },
+          };
+        default:
+          return prev;
+      }
+    });
+  });
+
+  const renderLiveStatus = (status?: LiveStatus) => {
+    if (!status) return null;
+    if (status.syncing > 0) {
+      return <span className="text-xs text-yellow-700">🔄 Syncing...</span>;
+    }
+    if (status.error) {
+      return (
+        <span className="text-xs text-red-700" title={status.error}>
+          ❌ Last pass failed
+        </span>
+      );
+    }
+    if (status.lastSync) {
+      return (
+        <span className="text-xs text-gray-500">
+          Synced {new Date(status.lastSync * 1000).toLocaleTimeString()}
+        </span>
+      );
+    }
+    return null;
+  };
+
   if (configs.length === 0) {
     return (
       <div className="text-center py-8">
@@ -50,6 +124,7 @@ export default function SyncConfigList({
               </p>
             </div>
             <div className="flex items-center space-x-2">
+              {renderLiveStatus(liveStatus[config.id])}
               <span
                 className={`inline-flex items-center px-2.5 py-0.5 rounded-full text-xs font-medium ${
                   config.is_active
@@ -65,6 +140,11 @@ export default function SyncConfigList({
       ))}
 
       <div className="pt-4 border-t border-gray-200">
+        <div className="text-xs text-gray-400 mb-2">
+          {connected
+            ? "● Live updates connected"
+            : "○ Live updates reconnecting..."}
+        </div>
         <button
           onClick={onManualSync}
           className="w-full bg-green-600 text-white py-2 px-4 rounded-md hover:bg-green-700 transition-colors"
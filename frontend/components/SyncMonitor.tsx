@@ -1,5 +1,6 @@
-import { useState, useEffect } from "react";
+import { useState } from "react";
 import axios from "axios";
+import useSyncEvents, { SyncEvent } from "../hooks/useSyncEvents";
 
 interface SyncConfig {
   id: string;
@@ -21,6 +22,50 @@ export default function SyncMonitor({ config }: SyncMonitorProps) {
   const [lastSync, setLastSync] = useState<Date | null>(null);
   const [syncCount, setSyncCount] = useState(0);
   const [error, setError] = useState<string | null>(null);
+  const [rowsChanged, setRowsChanged] = useState(0);
+  const [recentEvents, setRecentEvents] = useState<SyncEvent[]>([]);
+
+  // Pushed by the backend for every pass of this config, whatever triggered it
+  const connected = useSyncEvents((event: SyncEvent) => {
+    switch (event.type) {
+      case "pass_started":
+        setSyncStatus("syncing");
+        setError(null);
+        break;
+      case "pass_finished":
+        setSyncStatus("success");
+        setLastSync(new Date(event.time * 1000));
+        break;
+      case "pass_failed":
+        setSyncStatus("error");
+        setError(event.error || "Sync failed");
+        break;
+      case "rows_changed":
+        setRowsChanged(
+          (prev) => prev + (event.rows || 0) + (event.deleted || 0)
+        );
+        break;
+    }
+    if (event.type !== "lagged") {
+      setRecentEvents((prev) => [event, ...prev].slice(0, 10));
+    }
+  }, config.id);
+
+  const describeEvent = (event: SyncEvent) => {
+    const direction = event.direction ? event.direction.replace(/_/g, " ") : "";
+    switch (event.type) {
+      case "pass_started":
+        return `Started ${direction}`;
+      case "pass_finished":
+        return `Finished ${direction} in ${event.duration}s`;
+      case "pass_failed":
+        return `Failed ${direction}: ${event.error}`;
+      case "rows_changed":
+        return `${event.rows} rows written (${direction})`;
+      default:
+        return event.type;
+    }
+  };
 
   const triggerSync = async () => {
     setSyncStatus("syncing");
@@ -114,7 +159,7 @@ export default function SyncMonitor({ config }: SyncMonitorProps) {
       </div>
 
       {/* Sync Statistics */}
-      <div className="grid grid-cols-2 gap-4">
+      <div className="grid grid-cols-3 gap-4">
         <div className="bg-blue-50 rounded-lg p-4 text-center">
           <div className="text-2xl font-bold text-blue-600">{syncCount}</div>
           <div className="text-sm text-blue-800">Manual Syncs</div>
@@ -125,6 +170,36 @@ export default function SyncMonitor({ config }: SyncMonitorProps) {
           </div>
           <div className="text-sm text-purple-800">Last Sync</div>
         </div>
+        <div className="bg-green-50 rounded-lg p-4 text-center">
+          <div className="text-2xl font-bold text-green-600">{rowsChanged}</div>
+          <div className="text-sm text-green-800">Rows Changed</div>
+        </div>
+      </div>
+
+      {/* Live Activity */}
+      <div className="border border-gray-200 rounded-lg p-4">
+        <div className="flex items-center justify-between mb-2">
+          <h4 className="font-medium text-gray-900">Live Activity</h4>
+          <span className="text-xs text-gray-400">
+            {connected ? "● Connected" : "○ Reconnecting..."}
+          </span>
+        </div>
+        {recentEvents.length === 0 ? (
+          <div className="text-sm text-gray-500">
+            Waiting for sync passes...
+          </div>
+        ) : (
+          <ul className="text-sm text-gray-700 space-y-1">
+            {recentEvents.map((event, index) => (
+              <li key={event.id ?? index}>
+                <span className="text-gray-400 mr-2">
+                  {new Date(event.time * 1000).toLocaleTimeString()}
+                </span>
+                {describeEvent(event)}
+              </li>
+            ))}
+          </ul>
+        )}
       </div>
 
       {/* Manual Sync Button */}
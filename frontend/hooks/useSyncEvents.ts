@@ -0,0 +1,59 @@
+import { useEffect, useRef, useState } from "react";
+
+const API_BASE = "http://localhost:8000";
+
+export interface SyncEvent {
+  id?: number;
+  type:
+    | "pass_started"
+    | "pass_finished"
+    | "pass_failed"
+    | "rows_changed"
+    | "config_created"
+    | "lagged";
+  time: number;
+  config_id?: string;
+  direction?: string;
+  duration?: number;
+  rows?: number;
+  deleted?: number;
+  error?: string;
+  dropped?: number;
+}
+
+/**
+ * Subscribe to the backend's live sync event stream (server-sent events).
+ * Pass a configId to receive only that config's events. Returns whether the
+ * stream is currently connected; EventSource reconnects on its own.
+ */
+export default function useSyncEvents(
+  onEvent: (event: SyncEvent) => void,
+  configId?: string
+) {
+  const [connected, setConnected] = useState(false);
+  // Keep the latest handler without reopening the stream on every render
+  const handlerRef = useRef(onEvent);
+  handlerRef.current = onEvent;
+
+  useEffect(() => {
+    const query = configId ? `?config_id=${encodeURIComponent(configId)}` : "";
+    const source = new EventSource(`${API_BASE}/events${query}`);
+
+    source.onopen = () => setConnected(true);
+    source.onerror = () => setConnected(false);
+    source.onmessage = (message) => {
+      try {
+        handlerRef.current(JSON.parse(message.data));
+      } catch (err) {
+        console.error("Bad sync event:", err);
+      }
+    };
+
+    return () => {
+      source.close();
+      setConnected(false);
+    };
+  }, [configId]);
+
+  return connected;
+}
@@ -169,6 +169,7 @@ export default function Home() {
                     configs={configs}
                     onConfigSelected={setSelectedConfig}
                     onManualSync={handleManualSync}
+                    onConfigsChanged={fetchConfigs}
                   />
 
                   {/* Separate Sync Controls */}
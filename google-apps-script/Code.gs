@@ -12,6 +12,19 @@ const CONFIG = {
   SYNC_ENDPOINT: "/apps-script-sync",
   MAX_RETRIES: 3,
   RETRY_DELAY: 1000,
+  MAX_RETRY_AFTER_MS: 30000, // Cap on a backend-requested Retry-After wait
+  // Keep an edit counter in a hidden tab for the backend's "checksum" change
+  // probe; turn on only together with SHEETS_CHANGE_PROBE=checksum
+  USE_CHANGE_COUNTER: false,
+  CHANGE_COUNTER_SHEET: "_sync_meta",
+  DELTA_ENDPOINT: "/apps-script-delta", // Edited values applied to MySQL without a sheet read
+  MAX_DELTA_CELLS: 5000, // Larger edits fall back to a full sync request
+  DELTA_BATCH_ENDPOINT: "/apps-script-delta/batch",
+  // Edits are buffered and sent together once this many cells are pending,
+  // the oldest pending edit is this old, or the time-driven flush runs
+  FLUSH_CELLS: 500,
+  FLUSH_MAX_AGE_MS: 10000,
+  PENDING_EDITS_KEY: "PENDING_DELTAS",
 };
 
 /**
@@ -22,6 +35,13 @@ function onEditHandler(e) {
   console.log("Sheet edited, triggering real-time sync...");
 
   try {
+    if (e.range.getSheet().getName() === CONFIG.CHANGE_COUNTER_SHEET) {
+      return;
+    }
+    if (CONFIG.USE_CHANGE_COUNTER) {
+      bumpChangeCounter();
+    }
+
     const editInfo = {
       range: e.range.getA1Notation(),
       sheet: e.source.getActiveSheet().getName(),
@@ -33,17 +53,246 @@ function onEditHandler(e) {
     };
 
     console.log("Edit details:", editInfo);
-    triggerSyncWithRetry(editInfo);
+    const buffered = bufferEdit(e.range);
+    if (buffered === "too_large") {
+      // Send what is pending first so it is not applied after the resync
+      flushPendingEdits();
+    }
+    if (buffered !== "buffered") {
+      triggerSyncWithRetry(editInfo);
+    }
   } catch (error) {
     console.error("Error in onEditHandler:", error);
     showNotification("❌ Sync error: " + error.toString());
   }
 }
 
+/**
+ * Bump the edit counter the backend polls before reading the whole sheet
+ */
+function bumpChangeCounter() {
+  try {
+    const spreadsheet = SpreadsheetApp.getActiveSpreadsheet();
+    let metaSheet = spreadsheet.getSheetByName(CONFIG.CHANGE_COUNTER_SHEET);
+
+    if (!metaSheet) {
+      metaSheet = spreadsheet.insertSheet(CONFIG.CHANGE_COUNTER_SHEET);
+      metaSheet.hideSheet();
+    }
+
+    const counterCell = metaSheet.getRange("A1");
+    counterCell.setValue((Number(counterCell.getValue()) || 0) + 1);
+  } catch (error) {
+    console.error("Failed to bump change counter:", error);
+  }
+}
+
+/**
+ * Next delta sequence number for a tab; the backend detects lost deltas by gaps
+ * Callers hold the document lock
+ */
+function nextDeltaSequence(sheetName) {
+  const properties = PropertiesService.getDocumentProperties();
+  const key = "DELTA_SEQ_" + sheetName;
+  const seq = (Number(properties.getProperty(key)) || 0) + 1;
+  properties.setProperty(key, String(seq));
+  return seq;
+}
+
+/**
+ * Add the edited block to the pending buffer, flushing it when it is full or old
+ * Returns "buffered", "too_large" if the edit is too large to send as a delta,
+ * or "locked" if the buffer could not be locked
+ */
+function bufferEdit(range) {
+  const cells = range.getNumRows() * range.getNumColumns();
+  if (cells > CONFIG.MAX_DELTA_CELLS) {
+    return "too_large";
+  }
+
+  const sheet = range.getSheet();
+  const delta = {
+    sheet: sheet.getName(),
+    row: range.getRow(),
+    column: range.getColumn(),
+    // Display values match what the Sheets API returns to the backend
+    headers: sheet
+      .getRange(1, range.getColumn(), 1, range.getNumColumns())
+      .getDisplayValues()[0],
+    values: range.getDisplayValues(),
+  };
+
+  const lock = LockService.getDocumentLock();
+  if (!lock.tryLock(30000)) {
+    // A flush is holding the lock (e.g. waiting on a busy backend); sync this edit directly
+    console.warn("Edit buffer locked, falling back to a full sync");
+    return "locked";
+  }
+  let pending;
+  try {
+    pending = readPendingEdits();
+    pending.edits.push(delta);
+    pending.cells += cells;
+    pending.since = pending.since || Date.now();
+    if (!writePendingEdits(pending)) {
+      // Buffer value too large for the cache: send everything now
+      pending.cells = CONFIG.FLUSH_CELLS;
+    }
+  } finally {
+    lock.releaseLock();
+  }
+
+  if (
+    pending.cells >= CONFIG.FLUSH_CELLS ||
+    Date.now() - pending.since >= CONFIG.FLUSH_MAX_AGE_MS
+  ) {
+    flushPendingEdits();
+  }
+  return "buffered";
+}
+
+function readPendingEdits() {
+  const cached = CacheService.getDocumentCache().get(CONFIG.PENDING_EDITS_KEY);
+  return cached ? JSON.parse(cached) : { edits: [], cells: 0, since: null };
+}
+
+function writePendingEdits(pending) {
+  try {
+    // Cache entries live at most 6 hours; the time-driven flush runs every minute
+    CacheService.getDocumentCache().put(
+      CONFIG.PENDING_EDITS_KEY,
+      JSON.stringify(pending),
+      21600
+    );
+    return true;
+  } catch (error) {
+    console.error("Failed to buffer edit:", error);
+    return false;
+  }
+}
+
+/**
+ * Send all pending edits in one request, one sequence-numbered batch per tab
+ * Also run by the time-driven trigger created in setupTriggers(). The lock is
+ * held until the request is done so batches reach the backend in sequence order,
+ * but released before any fallback full syncs
+ */
+function flushPendingEdits() {
+  const lock = LockService.getDocumentLock();
+  if (!lock.tryLock(30000)) {
+    // Another flush is running; what is still pending goes out with the next one
+    console.warn("Could not take the edit buffer lock, leaving edits pending");
+    return;
+  }
+  let failedTabs = [];
+  try {
+    const pending = readPendingEdits();
+    if (!pending.edits.length) {
+      return;
+    }
+    CacheService.getDocumentCache().remove(CONFIG.PENDING_EDITS_KEY);
+
+    const byTab = {};
+    pending.edits.forEach((edit) => {
+      (byTab[edit.sheet] = byTab[edit.sheet] || []).push({
+        row: edit.row,
+        column: edit.column,
+        headers: edit.headers,
+        values: edit.values,
+      });
+    });
+    const payload = {
+      protocol: 1,
+      sheet_id: SpreadsheetApp.getActiveSpreadsheet().getId(),
+      batches: Object.keys(byTab).map((sheetName) => ({
+        sheet: sheetName,
+        seq: nextDeltaSequence(sheetName),
+        deltas: byTab[sheetName],
+      })),
+    };
+
+    // Held through the POST so batches reach the backend in sequence order
+    console.log(`Flushing ${pending.edits.length} buffered edits`);
+    if (!postWithRetry(CONFIG.DELTA_BATCH_ENDPOINT, payload)) {
+      failedTabs = Object.keys(byTab);
+    }
+  } finally {
+    lock.releaseLock();
+  }
+
+  // The backend will see a sequence gap and re-read these tabs anyway; a full
+  // sync now gets the data there sooner. Sent without the lock, since retries
+  // may wait on Retry-After and new edits must still be buffered meanwhile
+  failedTabs.forEach((sheetName) => {
+    triggerSyncWithRetry({
+      range: "BATCH_FLUSH_FAILED",
+      sheet: sheetName,
+      timestamp: new Date().toISOString(),
+      editType: "EDIT",
+    });
+  });
+}
+
+/**
+ * POST a JSON payload, retrying server errors; every attempt carries the same
+ * idempotency key, so the backend processes the payload once
+ */
+function postWithRetry(endpoint, payload) {
+  const idempotencyKey = Utilities.getUuid();
+  for (let attempt = 0; attempt <= CONFIG.MAX_RETRIES; attempt++) {
+    try {
+      const response = UrlFetchApp.fetch(CONFIG.BACKEND_URL + endpoint, {
+        method: "POST",
+        headers: {
+          "Content-Type": "application/json",
+          "User-Agent": "GoogleAppsScript-SuperjoinSync/1.0",
+          "ngrok-skip-browser-warning": "true",
+          "Idempotency-Key": idempotencyKey,
+        },
+        payload: JSON.stringify(payload),
+        muteHttpExceptions: true,
+      });
+      const status = response.getResponseCode();
+      if (status === 200) {
+        console.log("✅ Edits applied:", response.getContentText());
+        return true;
+      }
+      if (status === 429 || status === 503) {
+        // Backend is shedding load; wait as long as it asks before retrying
+        Utilities.sleep(retryDelayMs(response));
+        continue;
+      }
+      if (status < 500) {
+        console.error("Edits rejected:", response.getContentText());
+        return false;
+      }
+    } catch (error) {
+      console.error(`Attempt ${attempt + 1} failed:`, error);
+    }
+    Utilities.sleep(CONFIG.RETRY_DELAY);
+  }
+  return false;
+}
+
+/**
+ * Delay requested by a busy backend (429/503 Retry-After), capped so the
+ * retries stay within the Apps Script execution time limit
+ */
+function retryDelayMs(response) {
+  const headers = response.getHeaders();
+  const retryAfter = parseInt(headers["Retry-After"] || headers["retry-after"], 10);
+  if (isNaN(retryAfter)) {
+    return CONFIG.RETRY_DELAY;
+  }
+  return Math.min(retryAfter * 1000, CONFIG.MAX_RETRY_AFTER_MS);
+}
+
 /**
  * Trigger sync with retry logic
  */
-function triggerSyncWithRetry(editInfo, retryCount = 0) {
+function triggerSyncWithRetry(editInfo, retryCount = 0, idempotencyKey = null) {
+  // Every retry of this delivery carries the same key, so the backend runs it once
+  idempotencyKey = idempotencyKey || Utilities.getUuid();
   try {
     const sheetId = SpreadsheetApp.getActiveSpreadsheet().getId();
 
@@ -52,6 +301,7 @@ function triggerSyncWithRetry(editInfo, retryCount = 0) {
       edit_info: editInfo,
       trigger_source: "apps_script",
       timestamp: new Date().toISOString(),
+      idempotency_key: idempotencyKey,
     };
 
     console.log("Sending sync request:", payload);
@@ -64,6 +314,7 @@ function triggerSyncWithRetry(editInfo, retryCount = 0) {
           "Content-Type": "application/json",
           "User-Agent": "GoogleAppsScript-SuperjoinSync/1.0",
           "ngrok-skip-browser-warning": "true",
+          "Idempotency-Key": idempotencyKey,
         },
         payload: JSON.stringify(payload),
         muteHttpExceptions: true,
@@ -77,15 +328,18 @@ function triggerSyncWithRetry(editInfo, retryCount = 0) {
       console.log("✅ Sync successful:", responseText);
       showNotification("✅ Sync completed successfully!");
     } else {
-      throw new Error(`HTTP ${responseCode}: ${responseText}`);
+      const error = new Error(`HTTP ${responseCode}: ${responseText}`);
+      error.retryDelay = retryDelayMs(response);
+      throw error;
     }
   } catch (error) {
     console.error(`Sync attempt ${retryCount + 1} failed:`, error);
 
     if (retryCount < CONFIG.MAX_RETRIES) {
-      console.log(`Retrying in ${CONFIG.RETRY_DELAY}ms...`);
-      Utilities.sleep(CONFIG.RETRY_DELAY);
-      triggerSyncWithRetry(editInfo, retryCount + 1);
+      const delay = error.retryDelay || CONFIG.RETRY_DELAY;
+      console.log(`Retrying in ${delay}ms...`);
+      Utilities.sleep(delay);
+      triggerSyncWithRetry(editInfo, retryCount + 1, idempotencyKey);
     } else {
       console.error("❌ Max retries exceeded");
       showNotification(
@@ -130,10 +384,16 @@ function testConnection() {
       muteHttpExceptions: true,
     });
 
-    if (response.getResponseCode() === 200) {
-      const data = JSON.parse(response.getContentText());
+    const status = response.getResponseCode();
+    // 503 with a "degraded" body means the backend is up but a sync loop is stale
+    const data = status === 200 || status === 503 ? parseJson(response.getContentText()) : null;
+    if (data && data.status === "healthy") {
       console.log("✅ Backend connection successful:", data);
       showNotification("✅ Backend connection successful!");
+    } else if (data && data.status === "degraded") {
+      const stale = (data.sync_loops || []).filter((loop) => !loop.healthy);
+      console.warn("⚠️ Backend reachable, stale sync loops:", stale);
+      showNotification(`⚠️ Backend connected, but ${stale.length} sync loop(s) are stale`);
     } else {
       throw new Error(`Backend returned ${response.getResponseCode()}`);
     }
@@ -143,6 +403,17 @@ function testConnection() {
   }
 }
 
+/**
+ * Parsed JSON, or null if the text is not JSON
+ */
+function parseJson(text) {
+  try {
+    return JSON.parse(text);
+  } catch (error) {
+    return null;
+  }
+}
+
 /**
  * Setup triggers - run this once after pasting the code
  */
@@ -156,6 +427,9 @@ function setupTriggers() {
       ScriptApp.deleteTrigger(trigger);
     });
 
+    // Sends buffered edits that did not reach the flush threshold
+    ScriptApp.newTrigger("flushPendingEdits").timeBased().everyMinutes(1).create();
+
     console.log("✅ Triggers cleared - please set up manually");
     showNotification(
       "⚠️ Set up trigger manually: Triggers → Add → onEditHandler → On Edit"
@@ -16,6 +16,10 @@ def test_backend_endpoints(base_url):
         if response.status_code == 200:
             print("✅ Health check: PASSED")
             print(f"   Response: {response.json()}")
+        elif response.status_code == 503 and response.json().get("status") == "degraded":
+            # Reachable, but at least one sync loop has not succeeded recently
+            stale = [loop["config_id"] for loop in response.json()["sync_loops"] if not loop["healthy"]]
+            print(f"⚠️ Health check: DEGRADED (stale sync loops: {', '.join(stale)})")
         else:
             print(f"❌ Health check: FAILED ({response.status_code})")
     except Exception as e: